@@ -0,0 +1,175 @@
+import os
+import csv
+import sys
+import json
+import time
+import sqlite3
+import logging
+from array import array
+from zlib import crc32
+from typing import NamedTuple
+
+from utils import account_key
+
+
+class Account(NamedTuple):
+    # a tuple, so the rows waiting in the scheduler queue carry no per row dict
+    login: str
+    password: str
+    id: str
+    dcode: str
+    size: str
+    # the page the monitor polls for the account, an optional column as the id is not a url
+    product_url: str = ''
+
+    def api_data(self):
+        return self._asdict()
+
+
+def _records(file):
+    # offsets and bytes of the csv records from the current position, a quoted field may hold line breaks
+    offset = file.tell()
+    record = b''
+    for line in file:
+        record += line
+        # the quotes of a record are balanced, an escaped one is doubled
+        if record.count(b'"') % 2 == 0:
+            yield offset, record
+            offset += len(record)
+            record = b''
+    if record:
+        yield offset, record
+
+
+class AccountIndex:
+    # byte offsets of the csv rows with a hash bucket of their logins, so a shard reads only its own rows
+    RANGE = 'range'
+    HASH = 'hash'
+    SHARDINGS = (RANGE, HASH)
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f'{path}.idx'
+        self.columns = None
+        self.offsets = array('Q')
+        self.buckets = array('B')
+        self.built = None
+        stat = os.stat(path)
+        self._stamp = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if not self._load():
+            self._build()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'rb') as file:
+                meta = json.loads(file.readline())
+                if meta['stamp'] != self._stamp:
+                    return False
+                self.columns = meta['columns']
+                self.offsets.fromfile(file, meta['rows'])
+                self.buckets.fromfile(file, meta['rows'])
+        except (OSError, ValueError, KeyError, EOFError):
+            self.columns, self.offsets, self.buckets = None, array('Q'), array('B')
+            return False
+        return True
+
+    def _build(self):
+        started = time.perf_counter()
+        login_column = None
+        with open(self.path, 'rb') as file:
+            for offset, record in _records(file):
+                if self.columns is None:
+                    self.columns = next(csv.reader([record.decode()]))
+                    login_column = self.columns.index('login')
+                elif record.strip():
+                    login = next(csv.reader([record.decode()]))[login_column]
+                    self.offsets.append(offset)
+                    self.buckets.append(crc32(login.lower().encode()) & 0xff)
+        self.built = time.perf_counter() - started
+        try:
+            with open(self.index_path, 'wb') as file:
+                meta = {'stamp': self._stamp, 'columns': self.columns, 'rows': len(self.offsets)}
+                file.write(json.dumps(meta).encode() + b'\n')
+                self.offsets.tofile(file)
+                self.buckets.tofile(file)
+        except OSError:
+            logging.warning('index of %s is not saved, it is built again by the next run', self.path, exc_info=True)
+
+    def shard(self, shard=0, shards=1, sharding=HASH):
+        # numbers of the rows of the shard, a range of the file or the rows of the hash buckets
+        if sharding == self.RANGE:
+            size = -(-len(self) // shards)
+            return range(shard * size, min(len(self), (shard + 1) * size))
+        return (row for row, bucket in enumerate(self.buckets) if bucket % shards == shard)
+
+    def read(self, rows):
+        # the optional columns are last, a missing one takes its default
+        positions = [self.columns.index(field) for field in Account._fields
+                     if field in self.columns or field not in Account._field_defaults]
+        with open(self.path, 'rb') as file:
+            for row in rows:
+                file.seek(self.offsets[row])
+                _, record = next(_records(file))
+                values = next(csv.reader([record.decode()]))
+                yield Account(*(values[i] for i in positions))
+
+    def report(self):
+        row_bytes = self.offsets.itemsize + self.buckets.itemsize
+        sample = next(self.read(range(1)), None) if len(self) else None
+        # the record with its strings, it exists only while the row is queued or run
+        record_bytes = sys.getsizeof(sample) + sum(map(sys.getsizeof, sample)) if sample else 0
+        built = f'built in {self.built:.2f} s' if self.built is not None else 'loaded'
+        logging.info('account index of %s rows %s: %s bytes per row, %s bytes per queued record',
+                     len(self), built, row_bytes, record_bytes)
+
+
+class AccountStatus:
+    # the accounts finished by the previous runs, they are skipped
+    BATCH_SIZE = 100
+    FLUSH_INTERVAL = 5
+
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.db = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.db.execute('CREATE TABLE IF NOT EXISTS status (account TEXT PRIMARY KEY, state TEXT, updated REAL)')
+        self.completed = {key for key, in self.db.execute("SELECT account FROM status WHERE state = 'completed'")}
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.skipped = 0
+        self.flushes = 0
+        # the completions not written yet, an interrupted run does them again
+        self._pending = []
+        self._flushed = time.monotonic()
+
+    def pending(self, accounts):
+        for account in accounts:
+            if account_key(account.login) in self.completed:
+                self.skipped += 1
+                continue
+            yield account
+
+    def complete(self, login):
+        key = account_key(login)
+        self.completed.add(key)
+        self._pending.append((key, time.time()))
+        if len(self._pending) >= self.batch_size or time.monotonic() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        # a single transaction for the batch, not a commit by account on the loop
+        if self._pending:
+            with self.db:
+                self.db.execute('BEGIN')
+                self.db.executemany("INSERT OR REPLACE INTO status VALUES (?, 'completed', ?)", self._pending)
+            self._pending = []
+            self.flushes += 1
+        self._flushed = time.monotonic()
+
+    def report(self):
+        logging.info('account status: %s skipped as completed, %s writes', self.skipped, self.flushes)
+
+    def close(self):
+        self.flush()
+        self.db.close()
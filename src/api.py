@@ -1,18 +1,88 @@
+import re
+import json
 import logging
 from enum import IntEnum
+from types import MappingProxyType
+from functools import wraps
+from contextvars import ContextVar
 from dataclasses import dataclass, field
 
 import aiohttp.hdrs
 from aiohttp import ClientSession
 from yarl import URL
 
+from retries import RetryPolicy, TaskRetries
+
 
 with open('payloads/cookie-policy-accept.json') as ifile, \
         open('payloads/cookie-policy-init.json') as afile, \
         open('payloads/sensor-data.json') as sfile:
-    init_payload = ifile.read()
-    accept_payload = afile.read()
-    sensor_payload = sfile.read()
+    init_payload = ifile.read().encode()
+    accept_payload = afile.read().encode()
+    sensor_payload = sfile.read().encode()
+
+
+current_endpoint = ContextVar('endpoint', default=None)
+
+
+def endpoint(method):
+    # names the requests made by the method, e.g. for the tracing hooks, and repeats them by the retry policy
+    name = method.__name__
+
+    @wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        token = current_endpoint.set(name)
+        try:
+            if self.retries is None:
+                return await method(self, *args, **kwargs)
+            return await self.retries.call(name, self.RETRY_POLICIES.get(name, self.NO_RETRY),
+                                           lambda: method(self, *args, **kwargs))
+        finally:
+            current_endpoint.reset(token)
+    return wrapper
+
+
+class JsonTemplate:
+    # the body is serialized once, the `Var` values are spliced into it per request
+    PLACEHOLDER = re.compile(rb'"@@(\w+)@@"')
+
+    def __init__(self, template):
+        encoded = json.dumps(template).encode()
+        parts = self.PLACEHOLDER.split(encoded)
+        self.literals = parts[::2]
+        self.names = [name.decode() for name in parts[1::2]]
+
+    def render(self, **values):
+        chunks = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            chunks.append(json.dumps(values[name]).encode())
+            chunks.append(literal)
+        return b''.join(chunks)
+
+
+def Var(name):
+    return f'@@{name}@@'
+
+
+def _url(name):
+    return lambda cls: str(getattr(cls, name))
+
+
+def _origin(cls):
+    return str(cls.INDEX_URL.origin())
+
+
+@dataclass
+class BodyStats:
+    # bytes of the response bodies copied out of the connections and decoded to str by a flow
+    read: int = 0
+    decoded: int = 0
+    drained: int = 0
+    discarded: int = 0
+
+    def __str__(self):
+        return (f'{self.read} body bytes read, {self.decoded} decoded, {self.drained} drained, '
+                f'{self.discarded} bodies discarded')
 
 
 class CookiePolicyState(IntEnum):
@@ -64,317 +134,376 @@ class ZalandoAPI:
     H_ACCEPT_ALL = '*/*'
     MIME_JSON = 'application/json'
 
+    CHECKOUT_HEADERS = {
+        'x-zalando-header-mode': 'desktop',
+        'x-zalando-footer-mode': 'desktop',
+        'x-zalando-checkout-app': 'web',
+    }
+    # the constant headers of the requests, callables are resolved against the current urls by compile_endpoints
+    ENDPOINT_HEADERS = {
+        'resources': {'Accept': H_ACCEPT_ALL, 'Content-Type': 'text/plain;charset=UTF-8'},
+        'resources_post': {'Accept': H_ACCEPT_ALL, 'Content-Type': 'text/plain;charset=UTF-8', 'Origin': _origin},
+        'login_page': {'Accept': H_ACCEPT_TEXT, 'Upgrade-Insecure-Requests': '1'},
+        'api_consents': {'Accept': H_ACCEPT_ALL, 'Referer': _url('LOGIN_URL'), 'Origin': _origin,
+                         'Content-Type': 'text/plain;charset=UTF-8'},
+        'api_schema': {'Accept': MIME_JSON, 'Referer': _url('LOGIN_URL'), 'Content-Type': MIME_JSON,
+                       'x-zalando-render-page-uri': '/login', 'x-zalando-request-uri': '/login'},
+        'api_login': {'Referer': _url('LOGIN_URL'), 'Origin': _origin, 'Content-Type': MIME_JSON,
+                      'x-zalando-render-page-uri': '/login', 'x-zalando-request-uri': '/login'},
+        'api_sizereco': {'Accept': MIME_JSON, 'Origin': _origin, 'Content-Type': MIME_JSON},
+        'api_check_wishlist': {'Accept': H_ACCEPT_ALL, 'Origin': _origin},
+        'api_preference_brands': {'Accept': H_ACCEPT_ALL, 'Origin': _origin},
+        'api_cart': {'Accept': MIME_JSON, 'Origin': _origin, 'Content-Type': MIME_JSON},
+        'api_cart_count': {'Accept': H_ACCEPT_ALL, 'Origin': _origin},
+        'api_cart_details': {'Accept': H_ACCEPT_ALL, 'Origin': _origin},
+        'api_redeem': {'Referer': _url('CART_URL'), 'Origin': _origin, 'Content-Type': MIME_JSON},
+        'api_checkout_address_def': {'Referer': _url('CHK_ADDRESS_URL'), 'Origin': _origin, 'Content-Type': MIME_JSON,
+                                     **CHECKOUT_HEADERS},
+        'api_next_step': {'Referer': _url('CHK_ADDRESS_URL'), 'Origin': _origin, **CHECKOUT_HEADERS},
+        'api_remove_item': {'Accept': MIME_JSON, 'Referer': _url('CHK_CONFIRM_URL'), 'Origin': _origin,
+                            'Content-Type': MIME_JSON, **CHECKOUT_HEADERS},
+        'session_check': {'Accept': H_ACCEPT_TEXT, 'Upgrade-Insecure-Requests': '1'},
+        'myaccount_page': {'Accept': H_ACCEPT_TEXT, 'Referer': _url('LOGIN_URL'), 'Upgrade-Insecure-Requests': '1'},
+        'one_size_accessories_page': {'Accept': H_ACCEPT_TEXT, 'Referer': _url('MYACCOUNT_URL'),
+                                      'Upgrade-Insecure-Requests': '1'},
+        'product_page': {'Accept': H_ACCEPT_TEXT, 'Referer': _url('ACCESSORIES_URL'), 'Upgrade-Insecure-Requests': '1'},
+        'cart_page': {'Accept': H_ACCEPT_TEXT, 'Upgrade-Insecure-Requests': '1'},
+        'checkout_confirm_page': {'Accept': H_ACCEPT_TEXT, 'Referer': _url('CART_URL'), 'Upgrade-Insecure-Requests': '1'},
+        'payment': {'Accept': H_ACCEPT_TEXT, 'Referer': _url('CHK_ADDRESS_URL'), 'Upgrade-Insecure-Requests': '1'},
+    }
+    HEADERS = {}
+
+    IDEMPOTENT = RetryPolicy()
+    # the cart, the discount and the payment are changed on the server, so they are not sent twice
+    NOT_IDEMPOTENT = RetryPolicy(idempotent=False)
+    NO_RETRY = RetryPolicy(attempts=1)
+    RETRY_POLICIES = {
+        'resources': IDEMPOTENT,
+        'login_page': IDEMPOTENT,
+        'api_consents': NOT_IDEMPOTENT,
+        'api_schema': IDEMPOTENT,
+        'api_login': NOT_IDEMPOTENT,
+        'api_sizereco': IDEMPOTENT,
+        'api_check_wishlist': IDEMPOTENT,
+        'api_preference_brands': IDEMPOTENT,
+        'api_cart': NOT_IDEMPOTENT,
+        'api_cart_count': IDEMPOTENT,
+        'api_cart_details': IDEMPOTENT,
+        'api_redeem': NOT_IDEMPOTENT,
+        'api_checkout_address_def': IDEMPOTENT,
+        'api_next_step': IDEMPOTENT,
+        'api_remove_item': NOT_IDEMPOTENT,
+        'session_check': IDEMPOTENT,
+        'myaccount_page': IDEMPOTENT,
+        'one_size_accessories_page': IDEMPOTENT,
+        'product_page': IDEMPOTENT,
+        'cart_page': IDEMPOTENT,
+        'checkout_confirm_page': IDEMPOTENT,
+        'payment_session': NOT_IDEMPOTENT,
+        'payment_selection': NOT_IDEMPOTENT,
+        'payment_complete': NOT_IDEMPOTENT,
+    }
+
+    # an unread body is drained up to this size to keep its connection alive, a larger one closes it
+    DRAIN_LIMIT = 64 * 1024
+
+    LOGIN_BODY = JsonTemplate({'username': Var('username'), 'password': Var('password'), 'wnaMode': 'shop'})
+    SIZERECO_BODY = JsonTemplate({
+          "configSku": Var('config_sku'),
+          "isSizeFlagApplicable": False,
+          "isSizeRecoApplicable": False,
+          "isSizeTableApplicable": True,
+          "isSizeFinderApplicable": False,
+          "customerHash": Var('chash'),
+          "availableSimpleSkus": [Var('simple_sku')],
+          "silhouette": Var('silhouette'),
+          "targetGroup": "UNISEX",
+          "version": Var('version'),
+          "tableBounds": {
+               "filters": [
+                   {
+                       "targetGroups": [
+                           "MALE",
+                           "FEMALE",
+                           "UNISEX"
+                       ],
+                       "filterName": "matchStrictEqual"
+                   }
+               ],
+               "units": [
+                   {
+                       "local": "One Size",
+                       "local_type": "SE"
+                   }
+               ]
+           },
+          "localSizeType": "SE"
+        })
+    CART_BODY = JsonTemplate({'simpleSku': Var('simple_sku'), 'anonymous': False})
+    REDEEM_BODY = JsonTemplate({'cartId': Var('cart_id'), 'code': Var('code'), 'pageRenderFlowId': Var('flow_id')})
+    ADDRESS_DEF_BODY = json.dumps({'isDefaultShipping': True}).encode()
+    REMOVE_ITEM_BODY = JsonTemplate({'simpleSku': Var('simple_sku'), 'ids': []})
+
+    @classmethod
+    def compile_endpoints(cls):
+        cls.HEADERS = {name: MappingProxyType({k: v(cls) if callable(v) else v for k, v in headers.items()})
+                       for name, headers in cls.ENDPOINT_HEADERS.items()}
+
+    @classmethod
+    def set_index_url(cls, url):
+        # moves every endpoint to another origin, e.g. to a local stub server
+        url = URL(url).origin()
+        origin = cls.INDEX_URL.origin()
+        for name, value in list(vars(cls).items()):
+            if isinstance(value, URL) and value.origin() == origin:
+                setattr(cls, name, url.with_path(value.path))
+        cls.INDEX_URL = url
+        cls.CONSTANT_HEADERS = {**cls.CONSTANT_HEADERS,
+                                'Host': url.host if url.is_default_port() else f'{url.host}:{url.port}'}
+        cls.compile_endpoints()
+
     login: str
     password: str = field(repr=False)
     id: str
     dcode: str
     size: str
     session: ClientSession = field(repr=False, hash=False, compare=False)
+    retries: TaskRetries = field(default=None, repr=False, hash=False, compare=False)
+    bodies: BodyStats = field(default_factory=BodyStats, repr=False, hash=False, compare=False)
 
     @property
     def _cookies(self):
         return self.session.cookie_jar.filter_cookies(self.INDEX_URL)
 
+    async def _page(self, resp):
+        # the bytes as they are sent with their charset, the parsers decode them or detect it without one
+        body = await resp.read()
+        self.bodies.read += len(body)
+        return body, resp.charset
+
+    async def _json(self, resp):
+        body = await resp.read()
+        self.bodies.read += len(body)
+        self.bodies.decoded += len(body)
+        return json.loads(body)
+
+    async def _release(self, resp):
+        # the body is not needed, the connection is given back at once instead of when the response is collected
+        drained = 0
+        while drained <= self.DRAIN_LIMIT:
+            chunk = await resp.content.readany()
+            if not chunk:
+                self.bodies.drained += drained
+                resp.release()
+                return
+            drained += len(chunk)
+        # whatever its framing, a body over the limit is not worth its connection
+        self.bodies.discarded += 1
+        resp.close()
+
+    @endpoint
     async def resources(self, method, referer: str):
         logging.info('getting the resources')
-        headers = {
-            'Accept': self.H_ACCEPT_ALL,
-            'Content-Type': 'text/plain;charset=UTF-8',
-            'Referer': referer,
-        }
         if method == aiohttp.hdrs.METH_POST:
-            headers.update({'Origin': self.INDEX_URL.origin()})
-        resp = await self.session.request(method, self.RESR_URL, data=sensor_payload)
+            headers = {**self.HEADERS['resources_post'], 'Referer': referer}
+        else:
+            headers = {**self.HEADERS['resources'], 'Referer': referer}
+        resp = await self.session.request(method, self.RESR_URL, headers=headers, data=sensor_payload)
+        await self._release(resp)
 
+    @endpoint
     async def login_page(self):
         logging.info('getting a login page')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Upgrade-Insecure-Requests': '1'
-        }
-        resp = await self.session.get(self.LOGIN_URL, headers=headers)
+        resp = await self.session.get(self.LOGIN_URL, headers=self.HEADERS['login_page'])
+        await self._release(resp)
         return self._cookies['frsx'].value, self._cookies['Zalando-Client-Id'].value, resp.headers['x-zalando-child-request-id']
 
+    @endpoint
     async def api_consents(self, state: CookiePolicyState, xsrf):
         logging.info('consents api request')
-        headers = {
-            'Accept': self.H_ACCEPT_ALL,
-            'Referer': str(self.LOGIN_URL),
-            'Origin': str(self.INDEX_URL.origin()),
-            'Content-Type': 'text/plain;charset=UTF-8',
-            'x-xsrf-token': xsrf
-        }
+        headers = {**self.HEADERS['api_consents'], 'x-xsrf-token': xsrf}
         payload = CookiePolicyState.payload(state)
         resp = await self.session.post(self.API_CONSENTS, headers=headers, data=payload)
+        await self._release(resp)
         return resp.headers['x-zalando-child-request-id']
 
+    @endpoint
     async def api_schema(self, xsrf, client_id, flow_id):
         logging.info('schema api request')
         headers = {
-            'Accept': self.MIME_JSON,
-            'Referer': str(self.LOGIN_URL),
-            'Content-Type': self.MIME_JSON,
+            **self.HEADERS['api_schema'],
             'x-zalando-client-id': client_id,
-            'x-zalando-render-page-uri': '/login',
-            'x-zalando-request-uri': '/login',
             'x-flow-id': flow_id,
             'x-xsrf-token': xsrf,
             }
         resp = await self.session.get(self.API_SCHEMA_URL, headers=headers)
+        await self._release(resp)
 
+    @endpoint
     async def api_login(self, xsrf, client_id, flow_id):
         logging.info('login api request')
         headers = {
-            'Referer': str(self.LOGIN_URL),
-            'Origin': str(self.INDEX_URL.origin()),
+            **self.HEADERS['api_login'],
             'x-zalando-client-id': client_id,
-            'x-zalando-render-page-uri': '/login',
-            'x-zalando-request-uri': '/login',
             'x-flow-id': flow_id,
             'x-xsrf-token': xsrf,
             }
         resp = await self.session.post(self.API_LOGIN_URL, headers=headers,
-                                       json={'username': self.login, 'password': self.password, 'wnaMode': 'shop'})
+                                       data=self.LOGIN_BODY.render(username=self.login, password=self.password))
+        await self._release(resp)
 
     async def api_logout(self):
         pass
 
+    @endpoint
     async def api_sizereco(self, xsrf, referer, simple_sku, silhouette, version, chash):
         logging.info('sizereco api request')
-        headers = {
-            'Accept': self.MIME_JSON,
-            'Referer': str(referer),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-        }
-        data = {
-          "configSku": simple_sku.rstrip('0ONE000'),
-          "isSizeFlagApplicable": False,
-          "isSizeRecoApplicable": False,
-          "isSizeTableApplicable": True,
-          "isSizeFinderApplicable": False,
-          "customerHash": chash,
-          "availableSimpleSkus": [simple_sku],
-          "silhouette": silhouette,
-          "targetGroup": "UNISEX",
-          "version": version,
-          "tableBounds": {
-               "filters": [
-                   {
-                       "targetGroups": [
-                           "MALE",
-                           "FEMALE",
-                           "UNISEX"
-                       ],
-                       "filterName": "matchStrictEqual"
-                   }
-               ],
-               "units": [
-                   {
-                       "local": "One Size",
-                       "local_type": "SE"
-                   }
-               ]
-           },
-          "localSizeType": "SE"
-        }
-        resp = await self.session.post(self.API_SIZERECO, headers=headers, json=data)
+        headers = {**self.HEADERS['api_sizereco'], 'Referer': str(referer), 'x-xsrf-token': xsrf}
+        data = self.SIZERECO_BODY.render(config_sku=simple_sku.rstrip('0ONE000'), chash=chash, simple_sku=simple_sku,
+                                         silhouette=silhouette, version=version)
+        resp = await self.session.post(self.API_SIZERECO, headers=headers, data=data)
+        await self._release(resp)
 
+    @endpoint
     async def api_check_wishlist(self, xsrf, referer, simple_sku):
         logging.info('check wishlist api request')
-        headers = {
-            'Accept': self.H_ACCEPT_ALL,
-            'Referer': str(referer),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-        }
+        headers = {**self.HEADERS['api_check_wishlist'], 'Referer': str(referer), 'x-xsrf-token': xsrf}
         resp = await self.session.get(self.API_CHECK_WISHLIST, params={'configSku': simple_sku.rstrip('0ONE000')}, headers=headers)
+        await self._release(resp)
 
+    @endpoint
     async def api_preference_brands(self, xsrf, referer):
         logging.info('preference brands api request')
-        headers = {
-            'Accept': self.H_ACCEPT_ALL,
-            'Referer': str(referer),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-        }
+        headers = {**self.HEADERS['api_preference_brands'], 'Referer': str(referer), 'x-xsrf-token': xsrf}
         resp = await self.session.get(self.API_PREFERENCE_BRANDS, headers=headers)
+        await self._release(resp)
 
+    @endpoint
     async def api_cart(self, xsrf, referer, simple_sku):
         logging.info('cart api request')
-        headers = {
-            'Accept': self.MIME_JSON,
-            'Referer': str(referer),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-        }
-        resp = await self.session.post(self.API_CART, headers=headers,
-                                       json={'simpleSku': simple_sku, 'anonymous': False})
+        headers = {**self.HEADERS['api_cart'], 'Referer': str(referer), 'x-xsrf-token': xsrf}
+        resp = await self.session.post(self.API_CART, headers=headers, data=self.CART_BODY.render(simple_sku=simple_sku))
+        await self._release(resp)
 
+    @endpoint
     async def api_cart_count(self, xsrf, referer):
         logging.info('cart count api request')
-        headers = {
-            'Accept': self.H_ACCEPT_ALL,
-            'Referer': str(referer),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-        }
+        headers = {**self.HEADERS['api_cart_count'], 'Referer': str(referer), 'x-xsrf-token': xsrf}
         resp = await self.session.get(self.API_CART_COUNT, headers=headers)
-        count = await resp.json()
+        count = await self._json(resp)
         if count == 0:
             raise ValueError('Zero product count in a cart')
 
+    @endpoint
     async def api_cart_details(self, xsrf, referer):
         logging.info('cart details api request')
-        headers = {
-            'Accept': self.H_ACCEPT_ALL,
-            'Referer': str(referer),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-        }
+        headers = {**self.HEADERS['api_cart_details'], 'Referer': str(referer), 'x-xsrf-token': xsrf}
         resp = await self.session.get(self.API_CART_DETAILS, headers=headers)
+        await self._release(resp)
 
+    @endpoint
     async def api_redeem(self, xsrf, cart_id, flow_id):
         logging.info('redeem api request')
-        headers = {
-            'Referer': str(self.CART_URL),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-        }
+        headers = {**self.HEADERS['api_redeem'], 'x-xsrf-token': xsrf}
         resp = await self.session.post(self.API_REDEEM, headers=headers,
-                                       json={'cartId': cart_id, 'code': self.dcode, 'pageRenderFlowId': flow_id})
+                                       data=self.REDEEM_BODY.render(cart_id=cart_id, code=self.dcode, flow_id=flow_id))
+        await self._release(resp)
 
+    @endpoint
     async def api_checkout_address_def(self, xsrf, id):
         logging.info('checkout address api request')
-        headers = {
-            'Referer': str(self.CHK_ADDRESS_URL),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-            'x-zalando-header-mode': 'desktop',
-            'x-zalando-footer-mode': 'desktop',
-            'x-zalando-checkout-app': 'web',
-        }
+        headers = {**self.HEADERS['api_checkout_address_def'], 'x-xsrf-token': xsrf}
         url = self.API_CHK_ADDRESS_DEF.with_path(self.API_CHK_ADDRESS_DEF.path.format(id=id))
-        resp = await self.session.post(url, headers=headers, json={'isDefaultShipping': True})
+        resp = await self.session.post(url, headers=headers, data=self.ADDRESS_DEF_BODY)
+        await self._release(resp)
 
+    @endpoint
     async def api_next_step(self, xsrf):
         logging.info('next step api request')
-        headers = {
-            'Referer': str(self.CHK_ADDRESS_URL),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-            'x-zalando-header-mode': 'desktop',
-            'x-zalando-footer-mode': 'desktop',
-            'x-zalando-checkout-app': 'web',
-        }
+        headers = {**self.HEADERS['api_next_step'], 'x-xsrf-token': xsrf}
         resp = await self.session.get(self.API_NEXT_STEP, headers=headers)
-        data = await resp.json()
+        data = await self._json(resp)
         return data['url']
 
+    @endpoint
     async def api_remove_item(self, xsrf, simple_sku):
         logging.info('remove item api request')
-        headers = {
-            'Accept': self.MIME_JSON,
-            'Referer': str(self.CHK_CONFIRM_URL),
-            'Origin': str(self.INDEX_URL.origin()),
-            'x-xsrf-token': xsrf,
-            'x-zalando-header-mode': 'desktop',
-            'x-zalando-footer-mode': 'desktop',
-            'x-zalando-checkout-app': 'web',
-        }
+        headers = {**self.HEADERS['api_remove_item'], 'x-xsrf-token': xsrf}
         resp = await self.session.post(self.API_REMOVE_ITEM, headers=headers,
-                                       json={'simpleSku': simple_sku, 'ids': []})
-
+                                       data=self.REMOVE_ITEM_BODY.render(simple_sku=simple_sku))
+        await self._release(resp)
+
+    @endpoint
+    async def session_check(self):
+        logging.info('checking the session')
+        # a logged out session is redirected to the login page
+        # a stale session may be answered with 401 or 403 as well, which is not an error here
+        resp = await self.session.get(self.MYACCOUNT_URL, headers=self.HEADERS['session_check'], allow_redirects=False,
+                                      raise_for_status=False)
+        await self._release(resp)
+        return resp.status == 200
+
+    @endpoint
     async def myaccount_page(self):
         logging.info('getting a myaccount page')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Referer': str(self.LOGIN_URL),
-            'Upgrade-Insecure-Requests': '1'
-            }
-        resp = await self.session.get(self.MYACCOUNT_URL, headers=headers)
+        resp = await self.session.get(self.MYACCOUNT_URL, headers=self.HEADERS['myaccount_page'])
+        await self._release(resp)
 
+    @endpoint
     async def one_size_accessories_page(self):
         logging.info('getting a accessories page')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Referer': str(self.MYACCOUNT_URL),
-            'Upgrade-Insecure-Requests': '1'
-        }
-        resp = await self.session.get(self.ACCESSORIES_URL, headers=headers)
-        html = await resp.text()
-        return html
+        resp = await self.session.get(self.ACCESSORIES_URL, headers=self.HEADERS['one_size_accessories_page'])
+        return await self._page(resp)
 
+    @endpoint
     async def product_page(self, url: str):
         logging.info('getting a product page')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Referer': str(self.ACCESSORIES_URL),
-            'Upgrade-Insecure-Requests': '1'
-        }
-        resp = await self.session.get(url, headers=headers)
-        html = await resp.text()
-        return html
+        resp = await self.session.get(url, headers=self.HEADERS['product_page'])
+        return await self._page(resp)
 
+    @endpoint
     async def cart_page(self, referer):
         logging.info('getting a cart page')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Referer': str(referer),
-            'Upgrade-Insecure-Requests': '1'
-        }
+        headers = {**self.HEADERS['cart_page'], 'Referer': str(referer)}
         resp = await self.session.get(self.CART_URL, headers=headers)
-        html = await resp.text()
-        return html
+        return await self._page(resp)
 
+    @endpoint
     async def checkout_confirm_page(self):
         logging.info('getting a checkout confirm page')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Referer': str(self.CART_URL),
-            'Upgrade-Insecure-Requests': '1'
-        }
-        resp = await self.session.get(self.CHK_CONFIRM_URL, headers=headers)
-        html = await resp.text()
-        return html
+        resp = await self.session.get(self.CHK_CONFIRM_URL, headers=self.HEADERS['checkout_confirm_page'])
+        return await self._page(resp)
 
+    @endpoint
     async def payment_session(self, url):
         logging.info('getting a payment session')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Host': URL(url).host,
-            'Referer': str(self.CHK_ADDRESS_URL),
-            'Upgrade-Insecure-Requests': '1'
-        }
+        headers = {**self.HEADERS['payment'], 'Host': URL(url).host}
         resp = await self.session.get(url, headers=headers, allow_redirects=False)
+        await self._release(resp)
         if resp.status != 307:
             raise ValueError(f'Invalid redirection status {resp.status}')
         return resp.headers['location']
 
+    @endpoint
     async def payment_selection(self, url):
         logging.info('getting a payment selection')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Host': url.host,
-            'Referer': str(self.CHK_ADDRESS_URL),
-            'Upgrade-Insecure-Requests': '1',
-        }
+        headers = {**self.HEADERS['payment'], 'Host': url.host}
         resp = await self.session.get(url, headers=headers, allow_redirects=False)
-
+        await self._release(resp)
         if resp.status != 303:
             raise ValueError(f'Invalid redirection status {resp.status}')
         return resp.headers['location']
 
+    @endpoint
     async def payment_complete(self, url):
         logging.info('getting a checkout payment complete')
-        headers = {
-            'Accept': self.H_ACCEPT_TEXT,
-            'Host': URL(url).host,
-            'Referer': str(self.CHK_ADDRESS_URL),
-            'Upgrade-Insecure-Requests': '1',
-        }
+        headers = {**self.HEADERS['payment'], 'Host': URL(url).host}
         resp = await self.session.get(url, headers=headers)
+        await self._release(resp)
         resp.raise_for_status()
 
     async def purchase(self):
         pass
+
+
+ZalandoAPI.compile_endpoints()
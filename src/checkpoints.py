@@ -0,0 +1,58 @@
+import os
+import json
+import time
+import logging
+
+from utils import account_key
+
+
+class StepCheckpoints:
+    # the cart and the checkout of an account do not live long on the site
+    MAX_AGE = 60 * 60
+
+    def __init__(self, directory, max_age=MAX_AGE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_age = max_age
+        self.resumed = 0
+        self.steps_skipped = 0
+        self.requests_saved = 0
+        self.stale = 0
+
+    def _path(self, login):
+        return os.path.join(self.directory, f'{account_key(login)}.steps.json')
+
+    def load(self, login):
+        # returns the completed steps with their outputs and request counts, None if there is nothing to resume
+        try:
+            with open(self._path(login)) as file:
+                checkpoint = json.load(file)
+            if time.time() - checkpoint['saved'] > self.max_age:
+                self.stale += 1
+                self.clear(login)
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return checkpoint
+
+    def resume(self, checkpoint):
+        self.resumed += 1
+        self.steps_skipped += len(checkpoint['steps'])
+        self.requests_saved += sum(checkpoint['steps'].values())
+
+    def save(self, login, steps, data):
+        # written to a temporary file first, so an interrupted run does not leave a broken checkpoint
+        path = self._path(login)
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump({'saved': time.time(), 'steps': steps, 'data': data}, file)
+        os.replace(f'{path}.tmp', path)
+
+    def clear(self, login):
+        try:
+            os.remove(self._path(login))
+        except FileNotFoundError:
+            pass
+
+    def report(self):
+        logging.info('step checkpoints: %s tasks resumed, %s steps and %s requests saved, %s stale',
+                     self.resumed, self.steps_skipped, self.requests_saved, self.stale)
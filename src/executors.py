@@ -0,0 +1,92 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from functools import partial
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+
+from steps import current_step
+
+
+@dataclass
+class ParseStats:
+    calls: int = 0
+    wait: float = 0
+    wait_max: float = 0
+    parse: float = 0
+    parse_max: float = 0
+
+    def add(self, wait, parse):
+        self.calls += 1
+        self.wait += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.parse += parse
+        self.parse_max = max(self.parse_max, parse)
+
+    def __str__(self):
+        return (f'{self.calls} calls, '
+                f'wait avg {self.wait / self.calls * 10 ** 3:.1f} ms max {self.wait_max * 10 ** 3:.1f} ms, '
+                f'parse avg {self.parse / self.calls * 10 ** 3:.1f} ms max {self.parse_max * 10 ** 3:.1f} ms')
+
+
+def _timed_call(func, args):
+    # only a duration is measured where the call runs, the clocks of another process are not comparable
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+# the steps of the calls running in the parse threads by the thread, for the sampling profiler
+THREAD_STEPS = {}
+
+
+def _thread_call(func, args):
+    thread = threading.get_ident()
+    THREAD_STEPS[thread] = current_step.get()
+    try:
+        return _timed_call(func, args)
+    finally:
+        del THREAD_STEPS[thread]
+
+
+class ParseExecutor:
+    INLINE = 'inline'
+    THREAD = 'thread'
+    PROCESS = 'process'
+    KINDS = (INLINE, THREAD, PROCESS)
+
+    def __init__(self, kind=INLINE, workers=None):
+        self.kind = kind
+        self.stats = defaultdict(ParseStats)
+        if kind == self.THREAD:
+            self._pool = ThreadPoolExecutor(workers, thread_name_prefix='parse')
+        elif kind == self.PROCESS:
+            self._pool = ProcessPoolExecutor(workers)
+        else:
+            self._pool = None
+
+    async def run(self, func, *args):
+        submitted = time.perf_counter()
+        if self._pool is None:
+            result, parse = _timed_call(func, args)
+        else:
+            call = partial(_timed_call, func, args)
+            if self.kind == self.THREAD:
+                # the log records of the threads keep the ctx of the task, the profiler its step
+                call = partial(contextvars.copy_context().run, _thread_call, func, args)
+            loop = asyncio.get_running_loop()
+            result, parse = await loop.run_in_executor(self._pool, call)
+        wait = max(0, time.perf_counter() - submitted - parse)
+        self.stats[getattr(func, '__name__', repr(func))].add(wait, parse)
+        return result
+
+    def report(self):
+        for name, stats in sorted(self.stats.items()):
+            logging.info('%s parsing: %s', name, stats)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
@@ -0,0 +1,97 @@
+import re
+import asyncio
+import logging
+from collections import Counter
+
+
+# the warning of asyncio about a slow callback, it names the task the callback belongs to
+SLOW_CALLBACK = 'Executing %s took %.3f seconds'
+TASK_NAME = re.compile(r"<Task \w+ name='([^']*)'")
+CALLBACK = re.compile(r'<\w*Handle ([^(>]*)')
+
+
+def use_uvloop():
+    try:
+        import uvloop
+    except ImportError:
+        logging.warning('uvloop is not installed, the asyncio loop is used')
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def _offender(handle):
+    # the tasks are named ctx:step, the other callbacks are told by their function
+    match = TASK_NAME.search(handle)
+    if match:
+        return match.group(1)
+    match = CALLBACK.search(handle)
+    return match.group(1) if match else handle
+
+
+class LoopLagMonitor(logging.Filter):
+    # how late the loop wakes up a sleeping task, and which steps hold it with the callbacks timed by asyncio
+    INTERVAL = 0.05
+    SLOW_CALLBACK = 0.1
+    TOP = 5
+
+    def __init__(self, interval=INTERVAL, slow_callback=SLOW_CALLBACK, top=TOP):
+        super().__init__()
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.top = top
+        self.lags = []
+        self.stalls = 0
+        # seconds the loop was held for
+        self.offenders = Counter()
+        self.steps = Counter()
+        self._sampler = None
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self.slow_callback:
+            # the loop times the callbacks only in the debug mode, which slows it down as well
+            loop.slow_callback_duration = self.slow_callback
+            loop.set_debug(True)
+            logging.getLogger('asyncio').addFilter(self)
+        self._sampler = asyncio.ensure_future(self._sample())
+
+    async def _sample(self):
+        # the loop time is a real one, the warp clock does not apply to it
+        loop = asyncio.get_running_loop()
+        while True:
+            woken = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0, loop.time() - woken))
+
+    def filter(self, record):
+        if record.msg != SLOW_CALLBACK:
+            return True
+        handle, took = record.args
+        offender = _offender(handle)
+        self.stalls += 1
+        self.offenders[offender] += took
+        self.steps[offender.rpartition(':')[2]] += took
+        logging.debug('loop is held for %.3f s by %s', took, offender)
+        return False
+
+    def percentile(self, fraction):
+        lags = sorted(self.lags)
+        return lags[min(len(lags) - 1, int(fraction * len(lags)))] if lags else 0
+
+    def report(self):
+        logging.info('loop lag: p50 %.1f ms, p90 %.1f ms, p99 %.1f ms, max %.1f ms of %s samples, %s slow callbacks',
+                     *(self.percentile(f) * 1000 for f in (0.5, 0.9, 0.99, 1)), len(self.lags), self.stalls)
+        if self.stalls:
+            logging.info('loop is held by steps: %s', ', '.join(f'{step} {seconds:.3f} s' for step, seconds
+                                                                 in self.steps.most_common(self.top)))
+            logging.info('loop is held by tasks: %s', ', '.join(f'{offender} {seconds:.3f} s' for offender, seconds
+                                                                 in self.offenders.most_common(self.top)))
+
+    def stop(self):
+        if self._sampler is not None:
+            self._sampler.cancel()
+            self._sampler = None
+        if self.slow_callback:
+            logging.getLogger('asyncio').removeFilter(self)
+            asyncio.get_running_loop().set_debug(False)
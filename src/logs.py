@@ -0,0 +1,120 @@
+import sys
+import json
+import queue
+import logging
+from random import random
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+
+FORMAT = '[%(asctime)s %(levelname)s %(ctx)s] %(message)s'
+DATE_FORMAT = '%m-%d %H:%M:%S'
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {'time': self.formatTime(record, self.datefmt), 'level': record.levelname,
+                 'ctx': getattr(record, 'ctx', None), 'source': _source(record), 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def _source(record):
+    # the modules log through the root logger, so they are told apart by the module
+    return record.module if record.name == 'root' else record.name
+
+
+class SamplingFilter(logging.Filter):
+    # keeps a fraction of the info and debug records of a source or at most a rate per second of each of its messages,
+    # the rest always pass
+
+    def __init__(self, rates=None, limits=None):
+        super().__init__()
+        self.rates = rates or {}
+        self.limits = limits or {}
+        self.buckets = {}
+        self.dropped = Counter()
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        source = _source(record)
+        rate = self.rates.get(source)
+        if rate is not None and random() >= rate:
+            self.dropped[source] += 1
+            return False
+        limit = self.limits.get(source)
+        if limit is not None:
+            # a bucket per message template, a chatty line of a source does not silence its other lines
+            key = source, record.msg
+            tokens, updated = self.buckets.get(key, (limit, record.created))
+            tokens = min(limit, tokens + (record.created - updated) * limit)
+            if tokens < 1:
+                self.buckets[key] = tokens, record.created
+                self.dropped[source] += 1
+                return False
+            self.buckets[key] = tokens - 1, record.created
+        return True
+
+
+class LocalQueueHandler(QueueHandler):
+    # the listener is a thread of the same process, so the record is queued as it is and formatted there
+
+    def prepare(self, record):
+        return record
+
+
+class LoggingPipeline:
+
+    def __init__(self, level, stream=sys.stdout, queued=False, json_lines=False, rates=None, limits=None):
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(JsonFormatter(datefmt=DATE_FORMAT) if json_lines else
+                             logging.Formatter(FORMAT, datefmt=DATE_FORMAT))
+        self.sampling = SamplingFilter(rates, limits) if rates or limits else None
+        self.listener = None
+        if queued:
+            self.listener = QueueListener(queue.SimpleQueue(), handler)
+            handler = LocalQueueHandler(self.listener.queue)
+        if self.sampling is not None:
+            # before the queue, so the dropped records cost nothing more
+            handler.addFilter(self.sampling)
+        root = logging.getLogger()
+        # a forked shard inherits the handlers of its parent, they are given back by stop
+        self._previous = root.handlers[:], root.level
+        for old in self._previous[0]:
+            root.removeHandler(old)
+        root.addHandler(handler)
+        root.setLevel(level)
+        self.handler = handler
+        if self.listener is not None:
+            self.listener.start()
+
+    def report(self):
+        if self.sampling is not None and self.sampling.dropped:
+            logging.info('logging: dropped %s', ', '.join(f'{count} {source}' for source, count
+                                                          in sorted(self.sampling.dropped.items())))
+
+    def stop(self):
+        # writes out the queued records
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        if self._previous is not None:
+            root = logging.getLogger()
+            root.removeHandler(self.handler)
+            handlers, level = self._previous
+            for handler in handlers:
+                root.addHandler(handler)
+            root.setLevel(level)
+            self._previous = None
+
+
+def parse_limits(values):
+    # source=number pairs of the command line
+    limits = {}
+    for value in values or ():
+        source, _, number = value.partition('=')
+        limits[source] = float(number)
+    return limits
@@ -0,0 +1,140 @@
+import json
+import time
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+
+from aiohttp import TraceConfig
+
+from api import current_endpoint
+
+
+PHASES = ('queued', 'dns', 'connect', 'ttfb', 'body', 'total')
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRIC = 'zalando_request_phase_seconds'
+
+
+class Histogram:
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict(zip(map(str, self.buckets + ('+Inf',)), self.counts))}
+
+
+class PhaseMetrics:
+
+    def __init__(self):
+        self.histograms = defaultdict(lambda: defaultdict(Histogram))
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_connection_queued_start.append(self._on_connection_queued_start)
+        self.trace_config.on_connection_queued_end.append(self._on_connection_queued_end)
+        self.trace_config.on_dns_resolvehost_start.append(self._on_dns_resolvehost_start)
+        self.trace_config.on_dns_resolvehost_end.append(self._on_dns_resolvehost_end)
+        self.trace_config.on_connection_create_start.append(self._on_connection_create_start)
+        self.trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        self.trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        self.trace_config.on_request_chunk_sent.append(self._on_request_chunk_sent)
+        self.trace_config.on_request_redirect.append(self._on_request_redirect)
+        self.trace_config.on_request_end.append(self._on_request_end)
+
+    def _observe(self, endpoint, phase, value):
+        self.histograms[endpoint][phase].observe(value)
+
+    def _finish(self, ctx):
+        body_end = time.perf_counter()
+        self._observe(ctx.endpoint, 'body', body_end - ctx.end)
+        self._observe(ctx.endpoint, 'total', body_end - ctx.start)
+
+    async def _on_request_start(self, session, ctx, params):
+        # the phases are kept in the context of the request, the requests of a session may run at once
+        ctx.endpoint = current_endpoint.get() or params.url.path
+        ctx.start = ctx.sent = time.perf_counter()
+        ctx.queued = ctx.dns = ctx.connect = 0
+        ctx.end = None
+
+    async def _on_connection_queued_start(self, session, ctx, params):
+        ctx.queued_start = time.perf_counter()
+
+    async def _on_connection_queued_end(self, session, ctx, params):
+        ctx.queued += time.perf_counter() - ctx.queued_start
+
+    async def _on_dns_resolvehost_start(self, session, ctx, params):
+        ctx.dns_start = time.perf_counter()
+
+    async def _on_dns_resolvehost_end(self, session, ctx, params):
+        ctx.dns += time.perf_counter() - ctx.dns_start
+
+    async def _on_connection_create_start(self, session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+        ctx.connect_dns = ctx.dns
+
+    async def _on_connection_create_end(self, session, ctx, params):
+        ctx.sent = time.perf_counter()
+        # the host is resolved while the connection is created
+        ctx.connect += ctx.sent - ctx.connect_start - (ctx.dns - ctx.connect_dns)
+
+    async def _on_connection_reuseconn(self, session, ctx, params):
+        ctx.sent = time.perf_counter()
+
+    async def _on_request_chunk_sent(self, session, ctx, params):
+        ctx.sent = time.perf_counter()
+
+    async def _on_request_redirect(self, session, ctx, params):
+        # the phases of the hops are summed, time to the first byte is of the last hop
+        ctx.sent = time.perf_counter()
+
+    async def _on_request_end(self, session, ctx, params):
+        ctx.end = time.perf_counter()
+        self._observe(ctx.endpoint, 'queued', ctx.queued)
+        self._observe(ctx.endpoint, 'dns', ctx.dns)
+        self._observe(ctx.endpoint, 'connect', ctx.connect)
+        self._observe(ctx.endpoint, 'ttfb', ctx.end - ctx.sent)
+        # the body is read after the request end, its phases are taken once it is read to its end,
+        # a body which is released unread has none
+        params.response.content.on_eof(lambda: self._finish(ctx))
+
+    def as_dict(self):
+        return {endpoint: {phase: histogram.as_dict() for phase, histogram in phases.items()}
+                for endpoint, phases in sorted(self.histograms.items())}
+
+    def as_prometheus(self):
+        lines = [f'# HELP {METRIC} Duration of the request phases per ZalandoAPI method',
+                 f'# TYPE {METRIC} histogram']
+        for endpoint, phases in sorted(self.histograms.items()):
+            for phase in PHASES:
+                if phase not in phases:
+                    continue
+                histogram = phases[phase]
+                labels = f'endpoint="{endpoint}",phase="{phase}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append(f'{METRIC}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC}_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'{METRIC}_count{{{labels}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path):
+        with open(path, 'w') as file:
+            if path.endswith('.prom'):
+                file.write(self.as_prometheus())
+            else:
+                json.dump(self.as_dict(), file, indent=2)
+
+    def report(self):
+        for endpoint, phases in sorted(self.histograms.items()):
+            logging.info('%s: %s', endpoint, ', '.join(
+                f'{phase} avg {phases[phase].sum / phases[phase].count * 10 ** 3:.1f} ms'
+                for phase in PHASES if phase in phases and phases[phase].count))
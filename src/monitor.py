@@ -0,0 +1,254 @@
+import time
+import heapq
+import asyncio
+import logging
+from itertools import count
+from email.utils import parsedate_to_datetime
+
+from aiohttp import ClientSession, ClientTimeout
+from yarl import URL
+
+from api import ZalandoAPI
+from executors import ParseExecutor
+from parsing import find_product_units
+from pool import ConnectionPool
+from scheduler import TokenBucket
+from utils import get_clock, real_seconds, shared_now, wait_for
+
+
+class ProductWatch:
+
+    def __init__(self, url, interval):
+        self.url = url
+        self.etag = None
+        self.last_modified = None
+        # unit id: (size, available), None until the first poll
+        self.units = None
+        self.subscribers = set()
+        self.interval = interval
+        self.polled = None
+        self.changed = None
+        # smoothed seconds between the changes, None until two of them are seen
+        self.change_interval = None
+        # failed polls in a row
+        self.errors = 0
+
+
+class ProductMonitor:
+    # every product is polled once per its interval, whatever number of tasks are waiting for it
+    TIMEOUT = 10
+    MIN_INTERVAL = 1
+    MAX_INTERVAL = 60
+    # an unchanged product is polled this much less often each time
+    BACKOFF = 1.5
+    # polls wanted between two changes of a product
+    POLLS_PER_CHANGE = 4
+    SMOOTHING = 0.5
+    # failed polls in a row after which the waiting tasks get the error
+    MAX_ERRORS = 5
+    # seconds a task waits for its product to be available
+    WAIT_TIMEOUT = 3600
+
+    def __init__(self, interval, parser: ParseExecutor = None, pool: ConnectionPool = None,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL, bucket: TokenBucket = None,
+                 max_errors=MAX_ERRORS, wait_timeout=WAIT_TIMEOUT):
+        self.interval = interval
+        self.max_errors = max_errors
+        self.wait_timeout = wait_timeout
+        self.min_interval = min(min_interval, interval)
+        self.max_interval = max(max_interval, interval)
+        self.parser = parser or ParseExecutor()
+        self.pool = pool
+        self.bucket = bucket
+        self.watches = {}
+        self.session = None
+        # (next poll time, sequence, watch), the removed watches are dropped when they come up
+        self._heap = []
+        self._sequence = count()
+        # created with the scheduler in the running loop, the monitor is made before it
+        self._wakeup = None
+        self._scheduler = None
+        self._polls = set()
+        self.polls = 0
+        self.not_modified = 0
+        self.changes = 0
+        self.notifications = 0
+        self.errors = 0
+        self.delays = []
+
+    def _session(self):
+        if self.session is None:
+            # no cookies, the product pages are the same for everybody
+            trace_configs = [self.bucket.trace_config] if self.bucket is not None else []
+            if self.pool is None:
+                self.session = ClientSession(headers=ZalandoAPI.CONSTANT_HEADERS, timeout=ClientTimeout(total=self.TIMEOUT),
+                                             trace_configs=trace_configs)
+            else:
+                self.session = ClientSession(headers=self.pool.headers, timeout=ClientTimeout(total=self.TIMEOUT),
+                                             connector=self.pool.connector, connector_owner=False,
+                                             trace_configs=trace_configs + [self.pool.trace_config])
+        return self.session
+
+    def _schedule(self, watch, delay):
+        heapq.heappush(self._heap, (shared_now() + delay, next(self._sequence), watch))
+        self._wakeup.set()
+
+    def subscribe(self, url):
+        url = str(ZalandoAPI.INDEX_URL.join(URL(url)))
+        watch = self.watches.get(url)
+        if watch is None:
+            if self._scheduler is None:
+                self._wakeup = asyncio.Event()
+                self._scheduler = asyncio.ensure_future(self._run())
+            watch = self.watches[url] = ProductWatch(url, self.interval)
+            self._schedule(watch, 0)
+        queue = asyncio.Queue()
+        if watch.units is not None:
+            queue.put_nowait(watch.units)
+        watch.subscribers.add(queue)
+        return watch, queue
+
+    def unsubscribe(self, watch, queue):
+        watch.subscribers.discard(queue)
+        if not watch.subscribers:
+            del self.watches[watch.url]
+
+    async def wait_available(self, url, size=None):
+        # returns the id of the first available unit of the size, of any size if it is empty
+        watch, queue = self.subscribe(url)
+        try:
+            return await wait_for(self._wait_available(queue, size), self.wait_timeout)
+        finally:
+            self.unsubscribe(watch, queue)
+
+    @staticmethod
+    async def _wait_available(queue, size):
+        while True:
+            units = await queue.get()
+            if isinstance(units, Exception):
+                raise units
+            for unit_id, (unit_size, available) in units.items():
+                if available and (not size or unit_size == size):
+                    return unit_id
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, _, watch = self._heap[0]
+            if self.watches.get(watch.url) is not watch:
+                heapq.heappop(self._heap)
+                continue
+            delay = due - shared_now()
+            if delay > 0:
+                # a new watch may be due earlier
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), real_seconds(delay))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            poll = asyncio.ensure_future(self._poll(watch))
+            self._polls.add(poll)
+            poll.add_done_callback(self._polls.discard)
+
+    def _adapt(self, watch, changed, polled):
+        if changed and watch.changed is not None:
+            observed = polled - watch.changed
+            if watch.change_interval is None:
+                watch.change_interval = observed
+            else:
+                watch.change_interval += self.SMOOTHING * (observed - watch.change_interval)
+        if changed:
+            watch.changed = polled
+        if changed and watch.change_interval is not None:
+            interval = watch.change_interval / self.POLLS_PER_CHANGE
+        elif changed:
+            interval = self.interval
+        else:
+            interval = watch.interval * self.BACKOFF
+        watch.interval = min(self.max_interval, max(self.min_interval, interval))
+
+    def _detection_delay(self, watch, polled):
+        # since the page was modified, otherwise half the time since the previous poll
+        if watch.last_modified:
+            try:
+                modified = parsedate_to_datetime(watch.last_modified).timestamp()
+                return max(0, time.time() - modified) * get_clock().factor
+            except (TypeError, ValueError):
+                pass
+        return (polled - watch.polled) / 2
+
+    async def _fetch(self, watch):
+        headers = dict(ZalandoAPI.HEADERS['product_page'])
+        if watch.etag:
+            headers['If-None-Match'] = watch.etag
+        if watch.last_modified:
+            headers['If-Modified-Since'] = watch.last_modified
+        async with self._session().get(watch.url, headers=headers) as resp:
+            self.polls += 1
+            if resp.status == 304:
+                self.not_modified += 1
+                return None
+            resp.raise_for_status()
+            return (await resp.read(), resp.charset,
+                    resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+
+    def _failed(self, watch, error):
+        watch.errors += 1
+        if watch.errors < self.max_errors:
+            return
+        logging.error('polling %s is failed %s times in a row', watch.url, watch.errors)
+        for queue in watch.subscribers:
+            queue.put_nowait(error)
+
+    async def _poll(self, watch):
+        changed = False
+        try:
+            page = await self._fetch(watch)
+            if page is not None:
+                body, encoding, etag, last_modified = page
+                units = await self.parser.run(find_product_units, body, encoding)
+                # kept once the page is parsed, a broken page is not answered as not modified
+                watch.etag, watch.last_modified = etag, last_modified
+                if units != watch.units:
+                    if watch.units is not None:
+                        changed = True
+                        self.changes += 1
+                        self.delays.append(self._detection_delay(watch, shared_now()))
+                    watch.units = units
+                    logging.info('%s availability: %s', watch.url,
+                                 ', '.join(f'{size} {"yes" if available else "no"}' for size, available in units.values()))
+                    for queue in watch.subscribers:
+                        queue.put_nowait(units)
+                        self.notifications += 1
+            watch.errors = 0
+        except Exception as e:
+            self.errors += 1
+            logging.warning('polling %s is failed', watch.url, exc_info=True)
+            self._failed(watch, e)
+        finally:
+            # whatever the poll ends with, the watch is polled again while a task waits for it
+            polled = shared_now()
+            if watch.polled is not None:
+                self._adapt(watch, changed, polled)
+            watch.polled = polled
+            if self.watches.get(watch.url) is watch:
+                self._schedule(watch, watch.interval)
+
+    def report(self):
+        delay = f', detected in avg {sum(self.delays) / len(self.delays):.1f} s' if self.delays else ''
+        logging.info('monitor: %s polls, %s not modified, %s changes%s, %s notifications, %s errors',
+                     self.polls, self.not_modified, self.changes, delay, self.notifications, self.errors)
+
+    async def close(self):
+        for task in [self._scheduler, *self._polls]:
+            if task is not None:
+                task.cancel()
+        self.watches.clear()
+        self._heap.clear()
+        if self.session is not None:
+            await self.session.close()
@@ -1,38 +1,50 @@
+import sys
+import hashlib
 import logging
 import json
+import threading
+from collections import OrderedDict
+from functools import cached_property
 from random import choice
 from urllib.parse import unquote
 
 from lxml import etree
 
 
-def find_rand_product_url(text):
-    html = etree.HTML(text)
-    product_links = html.xpath('//z-grid-item[starts-with(@class, "cat_card")]//a')
-    return choice(product_links).attrib['href']
+PRODUCT_PROPS_ID = 'z-vegas-pdp-props'
+STREAM_CHUNK_SIZE = 16 * 1024
 
+PRODUCT_LINKS_XPATH = etree.XPath('//z-grid-item[starts-with(@class, "cat_card")]//a/@href')
+CART_DATA_XPATH = etree.XPath('//div[@id="app"]/@data-data')
+PRODUCT_PROPS_XPATH = etree.XPath('//script[@id=$id]/text()')
+ADDRESS_DATA_XPATH = etree.XPath('//div[@data-props]/@data-props')
 
-def find_redeem_params(text):
-    html = etree.HTML(text)
-    cart_data_divs = html.xpath('//div[@id="app"]')
-    count = len(cart_data_divs)
-    if count != 1:
-        logging.warning('%s divs. Cart data got from an undefined.')
-    data = cart_data_divs[0].attrib['data-data']
-    params = unquote(data)
-    params = json.loads(params)
-    cart_id = params['cart']['id']
-    flow_id = params['metadata']['flowId']
-    return cart_id, flow_id
-
-
-def find_product_params(text):
-    html = etree.HTML(text)
-    prod_data_divs = html.xpath('//script[@id="z-vegas-pdp-props"]')
-    data: str = prod_data_divs[0].text
+
+def _encoding(text, encoding):
+    # the bytes of a response are decoded by libxml2 itself, a str is already decoded
+    return encoding if isinstance(text, bytes) else None
+
+
+def _stream_product_props(text, chunk_size=STREAM_CHUNK_SIZE, encoding=None):
+    # feeds the page by chunks and stops at the end of the props script, the rest of the page is never parsed
+    parser = etree.HTMLPullParser(events=('end',), tag='script', encoding=_encoding(text, encoding))
+    for start in range(0, len(text), chunk_size):
+        parser.feed(text[start:start + chunk_size])
+        for _, element in parser.read_events():
+            if element.get('id') == PRODUCT_PROPS_ID:
+                return element.text
+            element.clear()
+    return None
+
+
+def _product_props(data: str):
     data = data.lstrip('<![CDATA')
     data = data.rstrip(']>')
-    params = json.loads(data)
+    return json.loads(data)
+
+
+def _product_params(data: str):
+    params = _product_props(data)
     units = params['model']['articleInfo']['units']
     id = next(filter(lambda u: u['available'], units))['id']
     silhouette = params['model']['articleInfo']['silhouette_code']
@@ -41,14 +53,160 @@ def find_product_params(text):
     return id, silhouette, version, uid_hash
 
 
-def find_address_id(text):
-    html = etree.HTML(text)
-    addr_data_divs = html.xpath('//div[@data-props]')
-    count = len(addr_data_divs)
-    if  count != 1:
-        logging.warning('%s divs. Address data got from an undefined.')
-    data = addr_data_divs[0].attrib['data-props']
-    params = unquote(data)
-    params = json.loads(params)
-    id = params['model']['addressDetails']['defaultShippingAddress']['id']
-    return id
\ No newline at end of file
+def _single(values, name):
+    count = len(values)
+    if count != 1:
+        logging.warning('%s divs. %s data got from an undefined.', count, name)
+    return values[0]
+
+
+def _size(value):
+    # the memory of a key or a result with its items, a few strings and numbers in tuples and dicts
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(map(_size, value))
+    elif isinstance(value, dict):
+        size += sum(_size(k) + _size(v) for k, v in value.items())
+    return size
+
+
+class ParseCache:
+    # results of the extractors by the hash of the document, the same page is parsed once while it is not changed;
+    # only the pages every task gets alike are cached
+    ENTRIES = 256
+    MAX_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, entries=ENTRIES, max_bytes=MAX_BYTES):
+        self.entries = entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._results = OrderedDict()
+        # the extractors run in the threads of the parse executor
+        self._lock = threading.Lock()
+
+    def get(self, name, text, extract, encoding=None):
+        if not self.entries:
+            return extract(text)
+        # the responses are hashed as they are read, only a str is encoded for it
+        data = text.encode() if isinstance(text, str) else text
+        key = name, _encoding(text, encoding), hashlib.blake2b(data, digest_size=16).digest()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        result = extract(text)
+        size = _size(key) + _size(result)
+        with self._lock:
+            if key not in self._results:
+                self._results[key] = result, size
+                self.bytes += size
+            while len(self._results) > self.entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self._results.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.bytes = 0
+
+    def report(self):
+        logging.info('parse cache: %s hits, %s misses, %s evictions, %s entries of %.1f KiB',
+                     self.hits, self.misses, self.evictions, len(self._results), self.bytes / 1024)
+
+
+# per process, the process executor workers have their own
+PARSE_CACHE = ParseCache()
+
+
+class ParsedPage:
+
+    def __init__(self, text, encoding=None):
+        self.text = text
+        self.encoding = _encoding(text, encoding)
+
+    @cached_property
+    def html(self):
+        if self.encoding:
+            return etree.HTML(self.text, etree.HTMLParser(encoding=self.encoding))
+        return etree.HTML(self.text)
+
+    @cached_property
+    def product_urls(self):
+        return [str(href) for href in PRODUCT_LINKS_XPATH(self.html)]
+
+    @cached_property
+    def redeem_params(self):
+        data = _single(CART_DATA_XPATH(self.html), 'Cart')
+        params = json.loads(unquote(data))
+        cart_id = params['cart']['id']
+        flow_id = params['metadata']['flowId']
+        return cart_id, flow_id
+
+    @cached_property
+    def product_params(self):
+        data = PRODUCT_PROPS_XPATH(self.html, id=PRODUCT_PROPS_ID)[0]
+        return _product_params(data)
+
+    @cached_property
+    def address_id(self):
+        data = _single(ADDRESS_DATA_XPATH(self.html), 'Address')
+        params = json.loads(unquote(data))
+        return params['model']['addressDetails']['defaultShippingAddress']['id']
+
+
+def find_rand_product_url(text, encoding=None):
+    # the links are cached, the choice is made per call
+    return choice(PARSE_CACHE.get('product_urls', text,
+                                  lambda text: tuple(ParsedPage(text, encoding).product_urls), encoding))
+
+
+def find_redeem_params(text, encoding=None):
+    # the cart page is of the account, it is not cached
+    return ParsedPage(text, encoding).redeem_params
+
+
+def find_product_params(text, encoding=None, streaming=True):
+    name = 'product_params' if streaming else 'product_params[full dom]'
+    return PARSE_CACHE.get(name, text, lambda text: _find_product_params(text, encoding, streaming), encoding)
+
+
+def _find_product_params(text, encoding, streaming):
+    if streaming:
+        try:
+            data = _stream_product_props(text, encoding=encoding)
+            if data is not None:
+                return _product_params(data)
+            logging.warning('product props are not found while streaming, fall back to the full page parsing')
+        except (etree.LxmlError, ValueError, KeyError):
+            logging.warning('streaming extraction is failed, fall back to the full page parsing', exc_info=True)
+    return ParsedPage(text, encoding).product_params
+
+
+def _product_units(data: str):
+    # availability of the sizes by the unit id, what the monitoring needs of a product page
+    units = _product_props(data)['model']['articleInfo']['units']
+    return {u['id']: (u['size']['local'], u['available']) for u in units}
+
+
+def find_product_units(text, encoding=None):
+    return PARSE_CACHE.get('product_units', text, lambda text: _find_product_units(text, encoding), encoding)
+
+
+def _find_product_units(text, encoding):
+    data = _stream_product_props(text, encoding=encoding)
+    if data is None:
+        data = PRODUCT_PROPS_XPATH(ParsedPage(text, encoding).html, id=PRODUCT_PROPS_ID)[0]
+    return _product_units(data)
+
+
+def find_address_id(text, encoding=None):
+    # the address page is of the account, it is not cached
+    return ParsedPage(text, encoding).address_id
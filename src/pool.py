@@ -0,0 +1,60 @@
+import logging
+
+from aiohttp import TCPConnector, TraceConfig
+
+from api import ZalandoAPI
+
+
+class ConnectionPool:
+    LIMIT = 100
+    LIMIT_PER_HOST = 30
+    DNS_TTL = 300
+    KEEPALIVE_TIMEOUT = 30
+
+    def __init__(self, limit=LIMIT, limit_per_host=LIMIT_PER_HOST, dns_ttl=DNS_TTL,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.opened = 0
+        self.reused = 0
+        self._connector = None
+        self._trace_config = TraceConfig()
+        self._trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        self._trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+
+    @property
+    def headers(self):
+        # keep-alive is the point of the pool, so `Connection: close` is not sent
+        return {k: v for k, v in ZalandoAPI.CONSTANT_HEADERS.items() if k != 'Connection'}
+
+    @property
+    def connector(self):
+        # created lazily as the connector has to be bound to the running loop
+        if self._connector is None:
+            self._connector = TCPConnector(limit=self.limit,
+                                           limit_per_host=self.limit_per_host,
+                                           use_dns_cache=True,
+                                           ttl_dns_cache=self.dns_ttl,
+                                           keepalive_timeout=self.keepalive_timeout)
+        return self._connector
+
+    @property
+    def trace_config(self):
+        return self._trace_config
+
+    async def _on_connection_create_end(self, session, trace_config_ctx, params):
+        self.opened += 1
+
+    async def _on_connection_reuseconn(self, session, trace_config_ctx, params):
+        self.reused += 1
+
+    def report(self):
+        total = self.opened + self.reused
+        ratio = self.reused / total * 100 if total else 0
+        logging.info('connections: %s opened, %s reused (%.1f%% handshakes saved)', self.opened, self.reused, ratio)
+
+    async def close(self):
+        if self._connector is not None:
+            await self._connector.close()
@@ -0,0 +1,116 @@
+import os
+import sys
+import asyncio
+import cProfile
+import logging
+import marshal
+import threading
+from collections import Counter, defaultdict
+
+from executors import THREAD_STEPS
+
+
+def _label(code):
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+
+def _key(code):
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class Profiler:
+    # the tasks run on the loop thread, the sampling adds the parse threads while they parse for a step
+    DETERMINISTIC = 'deterministic'
+    SAMPLING = 'sampling'
+    KINDS = (DETERMINISTIC, SAMPLING)
+    INTERVAL = 0.005
+
+    def __init__(self, path, kind=DETERMINISTIC, interval=INTERVAL):
+        self.path = path
+        self.kind = kind
+        self.interval = interval
+        # (step, code objects from the outermost frame), number of samples
+        self.samples = Counter()
+        self._profile = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self.kind == self.DETERMINISTIC:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True,
+                                        args=(asyncio.get_running_loop(), threading.get_ident()))
+        self._thread.start()
+
+    def _sample(self, loop, thread_id):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            if thread_id in frames:
+                # the tasks are named ctx:step by the flow, the callbacks out of a task run on the loop itself
+                task = asyncio.current_task(loop)
+                step = 'loop'
+                if task is not None:
+                    name = task.get_name()
+                    step = name.rpartition(':')[2] if ':' in name else 'task'
+                self._add(step, frames[thread_id])
+            for parse_thread, step in list(THREAD_STEPS.items()):
+                if parse_thread in frames:
+                    self._add(step or 'task', frames[parse_thread])
+
+    def _add(self, step, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        self.samples[step, tuple(reversed(stack))] += 1
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(f'{self.path}.pstats')
+            self._profile = None
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self._write_collapsed(f'{self.path}.collapsed')
+            self._write_stats(f'{self.path}.pstats')
+
+    def _write_collapsed(self, path):
+        # one line per stack with the step as its root frame, the input of flamegraph.pl and speedscope
+        with open(path, 'w') as file:
+            for (step, stack), count in self.samples.items():
+                file.write(f'{";".join([step, *map(_label, stack)])} {count}\n')
+
+    def _write_stats(self, path):
+        # the pstats layout of cProfile, the call counts are the numbers of the samples
+        own = Counter()
+        total = Counter()
+        callers = defaultdict(Counter)
+        for (_, stack), count in self.samples.items():
+            keys = [_key(code) for code in stack]
+            own[keys[-1]] += count
+            for key in set(keys):
+                total[key] += count
+            for caller, callee in set(zip(keys, keys[1:])):
+                callers[callee][caller] += count
+        stats = {key: (samples, samples, own[key] * self.interval, samples * self.interval,
+                       {caller: (n, n, 0, n * self.interval) for caller, n in callers[key].items()})
+                 for key, samples in total.items()}
+        with open(path, 'wb') as file:
+            marshal.dump(stats, file)
+
+    def report(self):
+        if self.kind == self.DETERMINISTIC:
+            logging.info('profile: written to %s.pstats', self.path)
+            return
+        steps = Counter()
+        for (step, _), count in self.samples.items():
+            steps[step] += count
+        total = sum(steps.values())
+        logging.info('profile: %s samples every %.0f ms written to %s.pstats and %s.collapsed, by steps: %s',
+                     total, self.interval * 1000, self.path, self.path,
+                     ', '.join(f'{step} {count / total:.0%}' for step, count in steps.most_common()))
@@ -0,0 +1,96 @@
+import csv
+import json
+import time
+import asyncio
+import logging
+from dataclasses import asdict, dataclass, field, fields
+
+
+@dataclass
+class TaskOutcome:
+    ctx: str
+    account: str
+    status: str
+    final_step: str
+    error: str = None
+    duration: float = 0
+    requests: int = 0
+    body_bytes: int = 0
+    decoded_bytes: int = 0
+    steps: dict = field(default_factory=dict)
+    finished: float = field(default_factory=time.time)
+
+
+class ResultSink:
+    # the tasks only queue their outcomes, a single writer appends them by batches from a thread
+    BATCH_SIZE = 100
+    FLUSH_INTERVAL = 1
+
+    def __init__(self, path, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.is_csv = path.endswith('.csv')
+        self.records = 0
+        self.batches = 0
+        self.write_time = 0
+        self.lost = 0
+        self._queue = None
+        self._writer = None
+
+    def emit(self, outcome: TaskOutcome):
+        if self._writer is None:
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.ensure_future(self._write_batches())
+        self._queue.put_nowait(outcome)
+
+    async def _write_batches(self):
+        loop = asyncio.get_running_loop()
+        closed = False
+        while not closed:
+            batch = []
+            outcome = await self._queue.get()
+            flush_at = loop.time() + self.flush_interval
+            while outcome is not None:
+                batch.append(outcome)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    outcome = await asyncio.wait_for(self._queue.get(), max(0, flush_at - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+            closed = outcome is None
+            if batch:
+                try:
+                    await loop.run_in_executor(None, self._write, batch)
+                except Exception as e:
+                    # the writer keeps draining the queue, the batch is lost
+                    self.lost += len(batch)
+                    logging.error('results: %s records are not written to %s: %r', len(batch), self.path, e)
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        with open(self.path, 'a', newline='') as file:
+            if self.is_csv:
+                writer = csv.writer(file)
+                if file.tell() == 0:
+                    writer.writerow(f.name for f in fields(TaskOutcome))
+                for outcome in batch:
+                    row = asdict(outcome)
+                    row['steps'] = json.dumps(row['steps'])
+                    writer.writerow(row.values())
+            else:
+                file.writelines(json.dumps(asdict(outcome)) + '\n' for outcome in batch)
+        self.records += len(batch)
+        self.batches += 1
+        self.write_time += time.perf_counter() - started
+
+    def report(self):
+        logging.info('results: %s records written to %s by %s batches in %.3f s, %s lost',
+                     self.records, self.path, self.batches, self.write_time, self.lost)
+
+    async def close(self):
+        if self._writer is not None:
+            self._queue.put_nowait(None)
+            await self._writer
+            self._writer = None
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from random import uniform
+from collections import Counter
+from dataclasses import dataclass
+
+from aiohttp import ClientConnectionError, ClientConnectorError, ClientResponseError
+
+from utils import now, shared_now, sleep_for
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    # a request which is not idempotent is repeated only when it has not reached the server
+    idempotent: bool = True
+    attempts: int = 3
+    backoff: float = 0.5
+    backoff_max: float = 5
+
+    def delay(self, attempt):
+        # full jitter, so the tasks failed together do not come back together
+        return uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+
+def is_transient(exc):
+    if isinstance(exc, ClientResponseError):
+        return exc.status >= 500 or exc.status == 429
+    return isinstance(exc, (ClientConnectionError, asyncio.TimeoutError))
+
+
+def describe(exc):
+    if isinstance(exc, ClientResponseError):
+        return f'status {exc.status}'
+    return exc.__class__.__name__
+
+
+def is_unsent(exc):
+    return isinstance(exc, ClientConnectorError)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.opens = 0
+
+    def allow(self):
+        if self.opened is None:
+            return True
+        if shared_now() - self.opened < self.reset_timeout:
+            return False
+        # half open, a single request probes the endpoint while the others are still rejected
+        self.opened = shared_now()
+        return True
+
+    def succeed(self):
+        self.failures = 0
+        self.opened = None
+
+    def fail(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened is None:
+                self.opens += 1
+            self.opened = shared_now()
+
+
+class Retries:
+    # shared by the tasks of a process, the breakers and the stats are per endpoint
+    BUDGET = 5
+    THRESHOLD = 5
+    RESET_TIMEOUT = 30
+
+    def __init__(self, budget=BUDGET, threshold=THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.budget = budget
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.retries = Counter()
+        self.recovered = Counter()
+        self.exhausted = Counter()
+        self.rejected = Counter()
+        self.retry_time = 0
+
+    def breaker(self, name):
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(self.threshold, self.reset_timeout)
+        return self.breakers[name]
+
+    def task(self):
+        return TaskRetries(self)
+
+    def report(self):
+        logging.info('retries: %s retried, %s recovered, %s given up, %.1f s spent retrying',
+                     sum(self.retries.values()), sum(self.recovered.values()), sum(self.exhausted.values()),
+                     self.retry_time)
+        for name in sorted(self.retries.keys() | self.exhausted.keys() | self.rejected.keys()):
+            logging.info('%s: %s retries, %s recovered, %s given up, %s rejected by the open circuit', name,
+                         self.retries[name], self.recovered[name], self.exhausted[name], self.rejected[name])
+        opened = {name: breaker.opens for name, breaker in self.breakers.items() if breaker.opens}
+        if opened:
+            logging.info('circuits opened: %s', ', '.join(f'{name} {opens} times' for name, opens in sorted(opened.items())))
+
+
+class TaskRetries:
+
+    def __init__(self, retries: Retries):
+        self.shared = retries
+        self.budget = retries.budget
+
+    async def call(self, name, policy, request):
+        breaker = self.shared.breaker(name)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self.shared.rejected[name] += 1
+                raise CircuitOpenError(f'{name} is failing, the circuit is open')
+            started = now()
+            try:
+                result = await request()
+            except Exception as exc:
+                if not is_transient(exc):
+                    raise
+                breaker.fail()
+                attempt += 1
+                if (attempt >= policy.attempts or self.budget <= 0
+                        or not (policy.idempotent or is_unsent(exc))):
+                    self.shared.exhausted[name] += 1
+                    raise
+                self.budget -= 1
+                self.shared.retries[name] += 1
+                delay = policy.delay(attempt)
+                logging.warning('%s failed with %s, retrying in %.2f s, attempt %s of %s',
+                                name, describe(exc), delay, attempt + 1, policy.attempts)
+                await sleep_for(delay)
+                self.shared.retry_time += now() - started
+                continue
+            breaker.succeed()
+            if attempt:
+                self.shared.recovered[name] += 1
+            return result
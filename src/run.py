@@ -1,18 +1,33 @@
 import sys
-import csv
 import asyncio
 import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser, FileType
 from contextvars import ContextVar
 
 import aiohttp.hdrs
-from aiohttp import ClientSession, ClientTimeout, TraceConfig
+from aiohttp import ClientSession, ClientTimeout, CookieJar, TraceConfig
 from yarl import URL
 
+from accounts import AccountIndex, AccountStatus
 from api import ZalandoAPI
-from tracing import on_request_chunk_sent, on_request_redirect, on_request_end
-from utils import make_ctx, Delay, sleep
-from parsing import find_product_params, find_address_id, find_rand_product_url, find_redeem_params
+from checkpoints import StepCheckpoints
+from executors import ParseExecutor
+from lag import LoopLagMonitor, use_uvloop
+from logs import LoggingPipeline, parse_limits
+from metrics import PhaseMetrics
+from monitor import ProductMonitor
+from pool import ConnectionPool
+from profiling import Profiler
+from results import ResultSink, TaskOutcome
+from retries import Retries
+from snapshots import SessionSnapshots
+from steps import Step, StepGraph, StepTimings, current_step
+from scheduler import TaskScheduler, TokenBucket, report_shards
+from tracing import FlightRecorder, debug_trace_config
+from utils import account_key, make_ctx, name_task, now, Delay, WarpClock, set_clock, sleep
+from parsing import PARSE_CACHE, ParseCache, find_product_params, find_address_id, find_rand_product_url, find_redeem_params
 
 
 TIMEOUT = 5
@@ -28,25 +43,63 @@ class ContextLogRecord(logging.LogRecord):
 logging.setLogRecordFactory(ContextLogRecord)
 
 
-def read_csv(file):
-    reader = csv.DictReader(file)
-    return [row for row in reader][:1]  # todo remove
-
-
 class PurchasingTask:
 
-    def __init__(self, api_data):
+    def __init__(self, api_data, parser: ParseExecutor = None, pool: ConnectionPool = None,
+                 metrics: PhaseMetrics = None, recorder_size=0,
+                 snapshots: SessionSnapshots = None, overlap_steps=False, checkpoints: StepCheckpoints = None,
+                 retries: Retries = None, monitor: ProductMonitor = None, bucket: TokenBucket = None,
+                 results: ResultSink = None):
+        trace_configs = []
+        # the debug hooks decode every body, so they are not attached at all above the debug level
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            trace_configs.append(debug_trace_config())
+        self.recorder = None
+        if recorder_size:
+            self.recorder = FlightRecorder(recorder_size)
+            trace_configs.append(self.recorder.trace_config)
+        # by the step, None for the requests out of the decrease steps
+        self.step_requests = Counter()
         trace_config = TraceConfig()
-        trace_config.on_request_end.append(on_request_end)
-        trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
-        trace_config.on_request_redirect.append(on_request_redirect)
-        self.session = ClientSession(raise_for_status=True,
-                                     headers=ZalandoAPI.CONSTANT_HEADERS,
-                                     timeout=ClientTimeout(total=SESSION_TIMEOUT),
-                                     trace_configs=[trace_config])
-        self.api = ZalandoAPI(session=self.session, **api_data)
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_configs.append(trace_config)
+        if metrics is not None:
+            # first, so the request end is timed before the other hooks run
+            trace_configs.insert(0, metrics.trace_config)
+        if bucket is not None:
+            # before the metrics, the wait for the budget is not a phase of the request
+            trace_configs.insert(0, bucket.trace_config)
+        if pool is None:
+            self.session = ClientSession(raise_for_status=True,
+                                         headers=ZalandoAPI.CONSTANT_HEADERS,
+                                         timeout=ClientTimeout(total=SESSION_TIMEOUT),
+                                         trace_configs=trace_configs)
+        else:
+            # the connector is shared between the tasks, the cookies are not
+            self.session = ClientSession(raise_for_status=True,
+                                         headers=pool.headers,
+                                         timeout=ClientTimeout(total=SESSION_TIMEOUT),
+                                         connector=pool.connector,
+                                         connector_owner=False,
+                                         cookie_jar=CookieJar(),
+                                         trace_configs=trace_configs + [pool.trace_config])
+        api_data = dict(api_data)
+        self.product_url = api_data.pop('product_url', None)
+        self.api = ZalandoAPI(session=self.session, retries=retries.task() if retries is not None else None, **api_data)
+        self.parser = parser or ParseExecutor()
+        self.snapshots = snapshots
+        self.overlap_steps = overlap_steps
+        self.checkpoints = checkpoints
+        self.monitor = monitor
+        self.results = results
+        self.stage = None
+        self.completed = {}
+        self.timings = StepTimings()
         logging.info('task for %s is initialized', self.api)
 
+    async def _on_request_start(self, session, ctx, params):
+        self.step_requests[current_step.get()] += 1
+
     def get_id(self):
         return make_ctx(self.api)
 
@@ -57,7 +110,24 @@ class PurchasingTask:
         await self.api.resources(aiohttp.hdrs.METH_POST, str(referer))
         await sleep(Delay.PAGE)
 
+    async def _restore_session(self):
+        snapshot = self.snapshots.load(self.api.login, self.session.cookie_jar)
+        if snapshot is None:
+            return None
+        if not await self.api.session_check():
+            logging.info('session snapshot is stale')
+            self.session.cookie_jar.clear()
+            self.snapshots.invalidate(self.api.login)
+            return None
+        self.snapshots.hit(snapshot)
+        logging.info('session is restored from a %.0f s old snapshot', snapshot['age'])
+        return snapshot['xsrf']
+
     async def log_in(self):
+        if self.snapshots is not None:
+            xsrf = await self._restore_session()
+            if xsrf is not None:
+                return xsrf
         logging.info('start logging in')
         xsrf, client_id, child_request_id = await self.api.login_page()
         await self._resources(self.api.LOGIN_URL)
@@ -66,108 +136,509 @@ class PurchasingTask:
         await self.api.api_schema(xsrf, client_id, child_request_id)
         await sleep(Delay.API)
         await self.api.api_login(xsrf, client_id, child_request_id)
+        if self.snapshots is not None:
+            self.snapshots.save(self.api.login, self.session.cookie_jar, xsrf, client_id)
         logging.info('logging in is finished')
         return xsrf
 
-    async def decrease_steps(self,  xsrf):
-        logging.info('start steps decreasing')
+    async def _myaccount_page(self, data):
         await self.api.myaccount_page()
+        return {'myaccount': True}
+
+    async def _myaccount_resources(self, data):
         await self._resources(self.api.MYACCOUNT_URL)
 
-        html = await self.api.one_size_accessories_page()
-        product_url = find_rand_product_url(html)
-        product_url = ZalandoAPI.INDEX_URL.join(URL(product_url))
+    async def _accessories_page(self, data):
+        body, encoding = await self.api.one_size_accessories_page()
+        product_url = await self.parser.run(find_rand_product_url, body, encoding)
+        return {'product_url': str(ZalandoAPI.INDEX_URL.join(URL(product_url)))}
+
+    async def _accessories_resources(self, data):
         await self._resources(self.api.ACCESSORIES_URL)
 
-        html = await self.api.product_page(product_url)
-        product_id, silhouette, version, uid_hash = find_product_params(html)
-        await self._resources(product_url)
+    async def _product_page(self, data):
+        body, encoding = await self.api.product_page(data['product_url'])
+        product_id, silhouette, version, uid_hash = await self.parser.run(find_product_params, body, encoding)
+        return {'product_id': product_id, 'silhouette': silhouette, 'version': version, 'uid_hash': uid_hash}
+
+    async def _product_resources(self, data):
+        await self._resources(data['product_url'])
 
-        await self.api.api_sizereco(xsrf, product_url, product_id, silhouette, version, uid_hash)
+    async def _sizereco(self, data):
+        await self.api.api_sizereco(data['xsrf'], data['product_url'], data['product_id'], data['silhouette'],
+                                    data['version'], data['uid_hash'])
         await sleep(Delay.API)
-        await self.api.api_check_wishlist(xsrf, product_url, product_id)
+
+    async def _check_wishlist(self, data):
+        await self.api.api_check_wishlist(data['xsrf'], data['product_url'], data['product_id'])
         await sleep(Delay.API)
-        await self.api.api_preference_brands(xsrf, product_url)
+
+    async def _preference_brands(self, data):
+        await self.api.api_preference_brands(data['xsrf'], data['product_url'])
         await sleep(Delay.CART)
-        await self.api.api_cart(xsrf, product_url, product_id)
+        return {'browsed': True}
+
+    async def _cart(self, data):
+        await self.api.api_cart(data['xsrf'], data['product_url'], data['product_id'])
         await sleep(Delay.API)
-        await self.api.api_cart_count(xsrf, product_url)
+        return {'cart': True}
+
+    async def _cart_count(self, data):
+        await self.api.api_cart_count(data['xsrf'], data['product_url'])
         await sleep(Delay.API)
-        await self.api.api_cart_details(xsrf, product_url)
+        return {'counted': True}
+
+    async def _cart_details(self, data):
+        await self.api.api_cart_details(data['xsrf'], data['product_url'])
         await sleep(Delay.API)
-        html = await self.api.cart_page(product_url)
-        cart_id, flow_id = find_redeem_params(html)
+        return {'detailed': True}
+
+    async def _cart_page(self, data):
+        body, encoding = await self.api.cart_page(data['product_url'])
+        cart_id, flow_id = await self.parser.run(find_redeem_params, body, encoding)
+        return {'cart_id': cart_id, 'flow_id': flow_id}
+
+    async def _cart_resources(self, data):
         await self._resources(self.api.CART_URL)
 
+    async def _redeem(self, data):
         # discount may be expired/invalid, or product already has it
-        await self.api.api_redeem(xsrf, cart_id, flow_id)
+        await self.api.api_redeem(data['xsrf'], data['cart_id'], data['flow_id'])
         await sleep(Delay.API)
-        html = await self.api.checkout_confirm_page()  # 302 /checkout/address
-        address_id = find_address_id(html)
+        return {'redeemed': True}
+
+    async def _checkout_page(self, data):
+        body, encoding = await self.api.checkout_confirm_page()  # 302 /checkout/address
+        return {'address_id': await self.parser.run(find_address_id, body, encoding)}
+
+    async def _checkout_resources(self, data):
         await self._resources(self.api.CHK_ADDRESS_URL)
 
-        await self.api.api_checkout_address_def(xsrf, address_id)
-        payment_session_url = URL(await self.api.api_next_step(xsrf))
+    async def _address_default(self, data):
+        await self.api.api_checkout_address_def(data['xsrf'], data['address_id'])
+        return {'address_set': True}
+
+    async def _next_step(self, data):
+        payment_session_url = await self.api.api_next_step(data['xsrf'])
         await sleep(Delay.API)
-        # 307,303, 302: payment.domain/selection, payment.domain/payment-complete, /checkout/confirm
-        location = await self.api.payment_session(payment_session_url)
-        payment_selection_url = payment_session_url.with_path(location)
+        return {'payment_session_url': payment_session_url}
+
+    # 307,303, 302: payment.domain/selection, payment.domain/payment-complete, /checkout/confirm
+    async def _payment_session(self, data):
+        location = await self.api.payment_session(data['payment_session_url'])
         await sleep(Delay.PAYMENT)
-        location = await self.api.payment_selection(payment_selection_url)
+        return {'payment_selection_url': str(URL(data['payment_session_url']).with_path(location))}
+
+    async def _payment_selection(self, data):
+        location = await self.api.payment_selection(URL(data['payment_selection_url']))
         await sleep(Delay.PAYMENT)
-        await self.api.payment_complete(location)
+        return {'payment_complete_url': location}
+
+    async def _payment_complete(self, data):
+        await self.api.payment_complete(data['payment_complete_url'])
+        return {'paid': True}
+
+    async def _confirm_resources(self, data):
         await self._resources(self.api.CHK_CONFIRM_URL)
+        return {'confirmed': True}
 
-        await self.api.api_remove_item(xsrf, product_id)
+    async def _remove_item(self, data):
+        await self.api.api_remove_item(data['xsrf'], data['product_id'])
         await sleep(Delay.PAGE)
+        return {'removed': True}
+
+    async def _final_cart_page(self, data):
         await self.api.cart_page(self.api.CHK_CONFIRM_URL)
+        return {'final_cart': True}
+
+    async def _final_cart_resources(self, data):
         await self._resources(self.api.CART_URL)
-        logging.info('steps decreasing is finished')
+
+    def _checkpoint(self, step, data):
+        self.completed[step.name] = self.step_requests[step.name]
+        # the token is of the session, a resumed task gets a new one by logging in
+        self.checkpoints.save(self.api.login, self.completed, {k: v for k, v in data.items() if k != 'xsrf'})
+
+    async def decrease_steps(self,  xsrf):
+        logging.info('start steps decreasing')
+        data = {}
+        if self.checkpoints is not None:
+            checkpoint = self.checkpoints.load(self.api.login)
+            if checkpoint is not None:
+                self.checkpoints.resume(checkpoint)
+                self.completed, data = checkpoint['steps'], checkpoint['data']
+                logging.info('resuming after %s completed steps', len(self.completed))
+        data['xsrf'] = xsrf
+        on_step = self._checkpoint if self.checkpoints is not None else None
+        await self.DECREASE_STEPS.run(self, data, self.overlap_steps, self.completed, on_step, self.timings)
+        logging.info('steps decreasing is finished in %.1f s, critical path %.1f s: %s', self.timings.wall,
+                     self.timings.critical, ' > '.join(self.timings.critical_path))
 
     async def monitor_purchase(self):
         logging.info('start monitoring')
+        if self.monitor is None:
+            return
+        if not self.product_url:
+            logging.warning('no product_url of the account, the product is not monitored')
+            return
+        unit_id = await self.monitor.wait_available(self.product_url, self.api.size)
+        logging.info('%s is available', unit_id)
+        await self.api.purchase()
 
     async def log_out(self):
         await self.api.api_logout()
 
+    def _dump_records(self):
+        if self.recorder is not None:
+            self.recorder.dump()
+
+    def _final_step(self):
+        if self.stage != 'decrease_steps':
+            return self.stage
+        if self.timings.failed:
+            return self.timings.failed
+        # the last finished one, while the task is monitoring or stopped between the steps
+        return max(self.timings.spans, key=lambda name: self.timings.spans[name][1], default=self.stage)
+
+    def _emit_outcome(self, status, started, error=None):
+        if self.results is None:
+            return
+        self.results.emit(TaskOutcome(ctx=self.get_id(),
+                                      account=account_key(self.api.login),
+                                      status=status,
+                                      final_step=self._final_step(),
+                                      error=error.__class__.__name__ if error is not None else None,
+                                      duration=now() - started,
+                                      requests=sum(self.step_requests.values()),
+                                      body_bytes=self.api.bodies.read,
+                                      decoded_bytes=self.api.bodies.decoded,
+                                      steps={name: round(d, 3) for name, d in self.timings.durations.items()}))
+
+    def _set_stage(self, stage):
+        self.stage = stage
+        # the loop lag monitor tells the tasks holding the loop by their names
+        name_task(f'{self.get_id()}:{stage}')
+
     async def run(self):
         logging.info('task is running')
-        xsrf = await self.log_in()
-        await sleep(Delay.PAGE)
-        await self.decrease_steps(xsrf)
-        await self.monitor_purchase()
-        await self.log_out()
-        await self.session.close()
-        logging.info('task is finished')
-
-
-async def main(csv):
-    logging.info('create tasks')
-    atasks = []
-    for api_data in read_csv(csv):
-        ptask = PurchasingTask(api_data)
-        ptask_id.set(ptask.get_id())
-        atask = asyncio.create_task(ptask.run())
-        atasks.append(atask)
-
-    logging.info('wait for tasks completion')
-    for f in asyncio.as_completed(atasks):
+        started = now()
+        name = asyncio.current_task().get_name()
         try:
-            res = await f
-        except:
-            logging.exception('')
-
+            self._set_stage('log_in')
+            xsrf = await self.log_in()
+            await sleep(Delay.PAGE)
+            self._set_stage('decrease_steps')
+            await self.decrease_steps(xsrf)
+            self._set_stage('monitor_purchase')
+            await self.monitor_purchase()
+            self._set_stage('log_out')
+            await self.log_out()
+            if self.checkpoints is not None:
+                self.checkpoints.clear(self.api.login)
+        except Exception as e:
+            self._dump_records()
+            logging.exception('task is failed')
+            self._emit_outcome('failed', started, e)
+            raise
+        except asyncio.CancelledError as e:
+            self._dump_records()
+            logging.error('task is cancelled')
+            self._emit_outcome('cancelled', started, e)
+            raise
+        finally:
+            name_task(name)
+            await self.session.close()
+        self._emit_outcome('succeeded', started)
+        logging.info('task is finished, %s', self.api.bodies)
+
+
+PurchasingTask.DECREASE_STEPS = StepGraph([
+    Step('myaccount_page', PurchasingTask._myaccount_page, provides=('myaccount',)),
+    Step('myaccount_resources', PurchasingTask._myaccount_resources, requires=('myaccount',)),
+    Step('accessories_page', PurchasingTask._accessories_page, requires=('myaccount',), provides=('product_url',)),
+    Step('accessories_resources', PurchasingTask._accessories_resources, requires=('product_url',)),
+    Step('product_page', PurchasingTask._product_page, requires=('product_url',),
+         provides=('product_id', 'silhouette', 'version', 'uid_hash')),
+    Step('product_resources', PurchasingTask._product_resources, requires=('product_url', 'product_id')),
+    Step('sizereco', PurchasingTask._sizereco,
+         requires=('xsrf', 'product_url', 'product_id', 'silhouette', 'version', 'uid_hash')),
+    Step('check_wishlist', PurchasingTask._check_wishlist, requires=('xsrf', 'product_url', 'product_id')),
+    Step('preference_brands', PurchasingTask._preference_brands, requires=('xsrf', 'product_url', 'product_id'),
+         provides=('browsed',)),
+    # the cart is added to after the pause of the browsing, and the cart requests keep the order of a browser
+    Step('cart', PurchasingTask._cart, requires=('xsrf', 'product_url', 'product_id', 'browsed'), provides=('cart',)),
+    Step('cart_count', PurchasingTask._cart_count, requires=('xsrf', 'product_url', 'cart'), provides=('counted',)),
+    Step('cart_details', PurchasingTask._cart_details, requires=('xsrf', 'product_url', 'counted'),
+         provides=('detailed',)),
+    Step('cart_page', PurchasingTask._cart_page, requires=('product_url', 'detailed'), provides=('cart_id', 'flow_id')),
+    Step('cart_resources', PurchasingTask._cart_resources, requires=('cart_id',)),
+    Step('redeem', PurchasingTask._redeem, requires=('xsrf', 'cart_id', 'flow_id'), provides=('redeemed',)),
+    Step('checkout_page', PurchasingTask._checkout_page, requires=('redeemed',), provides=('address_id',)),
+    Step('checkout_resources', PurchasingTask._checkout_resources, requires=('address_id',)),
+    Step('address_default', PurchasingTask._address_default, requires=('xsrf', 'address_id'),
+         provides=('address_set',)),
+    Step('next_step', PurchasingTask._next_step, requires=('xsrf', 'address_set'), provides=('payment_session_url',)),
+    Step('payment_session', PurchasingTask._payment_session, requires=('payment_session_url',),
+         provides=('payment_selection_url',)),
+    Step('payment_selection', PurchasingTask._payment_selection, requires=('payment_selection_url',),
+         provides=('payment_complete_url',)),
+    Step('payment_complete', PurchasingTask._payment_complete, requires=('payment_complete_url',), provides=('paid',)),
+    Step('confirm_resources', PurchasingTask._confirm_resources, requires=('paid',), provides=('confirmed',)),
+    Step('remove_item', PurchasingTask._remove_item, requires=('xsrf', 'product_id', 'confirmed'),
+         provides=('removed',)),
+    Step('final_cart_page', PurchasingTask._final_cart_page, requires=('removed',), provides=('final_cart',)),
+    Step('final_cart_resources', PurchasingTask._final_cart_resources, requires=('final_cart',)),
+], initial=('xsrf',))
+
+
+async def run_flow(api_data, **options):
+    ptask = PurchasingTask(api_data, **options)
+    ptask_id.set(ptask.get_id())
+    await ptask.run()
+
+
+async def run_account(account, options, status: AccountStatus = None):
+    await run_flow(account.api_data(), **options)
+    if status is not None:
+        status.complete(account.login)
+
+
+async def main(index: AccountIndex, options, concurrency=TaskScheduler.CONCURRENCY, deadline=None, shard=0, shards=1,
+               sharding=AccountIndex.HASH, status: AccountStatus = None, lag: LoopLagMonitor = None,
+               profiler: Profiler = None):
+    logging.info('run tasks')
+    scheduler = TaskScheduler(lambda account: run_account(account, options, status), concurrency, deadline)
+    accounts = index.read(index.shard(shard, shards, sharding))
+    if status is not None:
+        accounts = status.pending(accounts)
+    # an interrupted run still gives the loop its normal mode back and writes out the profile
+    if lag is not None:
+        lag.start()
+    try:
+        if profiler is not None:
+            profiler.start()
+        try:
+            await scheduler.run(accounts)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+    finally:
+        if lag is not None:
+            lag.stop()
+
+    scheduler.report()
+    if lag is not None:
+        lag.report()
+    if profiler is not None:
+        profiler.report()
+    if status is not None:
+        status.report()
+    options['parser'].report()
+    if PARSE_CACHE.entries and options['parser'].kind != ParseExecutor.PROCESS:
+        PARSE_CACHE.report()
+    if options.get('monitor') is not None:
+        options['monitor'].report()
+        await options['monitor'].close()
+    if options.get('pool') is not None:
+        options['pool'].report()
+        await options['pool'].close()
+    if options.get('metrics') is not None:
+        options['metrics'].report()
+    if options.get('snapshots') is not None:
+        options['snapshots'].report()
+    if options.get('checkpoints') is not None:
+        options['checkpoints'].report()
+    if options.get('retries') is not None:
+        options['retries'].report()
+    if options.get('bucket') is not None:
+        options['bucket'].report()
+    if options.get('results') is not None:
+        await options['results'].close()
+        options['results'].report()
     logging.info('done')
+    return scheduler.stats
+
+
+def shard_path(path, shard, shards):
+    if shards == 1:
+        return path
+    stem, dot, suffix = path.rpartition('.')
+    return f'{stem}-{shard}.{suffix}' if dot else f'{path}-{shard}'
+
+
+def configure_logging(args):
+    return LoggingPipeline(logging._nameToLevel[args.log_level.upper()], sys.stdout, args.log_queue, args.log_json,
+                           parse_limits(args.log_sample), parse_limits(args.log_rate_limit))
+
+
+def run_process(args, shard=0, shards=1):
+    pipeline = configure_logging(args)
+    if args.index_url:
+        ZalandoAPI.set_index_url(args.index_url)
+    if args.clock_warp != 1:
+        set_clock(WarpClock(args.clock_warp))
+    if shards > 1:
+        ptask_id.set(f'TaskRunner-{shard}')
+    PARSE_CACHE.entries = args.parse_cache
+    PARSE_CACHE.max_bytes = args.parse_cache_bytes
+    if args.profile and args.parse_executor != ParseExecutor.INLINE and (
+            args.profile_mode == Profiler.DETERMINISTIC or args.parse_executor == ParseExecutor.PROCESS):
+        # cProfile sees only the loop thread and no profiler sees the process pool
+        logging.warning('the pages are parsed inline while profiling in the %s mode', args.profile_mode)
+        args.parse_executor = ParseExecutor.INLINE
+    options = {'parser': ParseExecutor(args.parse_executor, args.parse_workers)}
+    if args.pooled:
+        options['pool'] = ConnectionPool(args.pool_limit, args.pool_limit_per_host, args.dns_ttl)
+    if args.metrics:
+        options['metrics'] = PhaseMetrics()
+    if args.rps:
+        # the shards share the budget
+        options['bucket'] = TokenBucket(args.rps / shards)
+    if args.monitor:
+        options['monitor'] = ProductMonitor(args.timeout, options['parser'], options.get('pool'),
+                                            args.poll_min_interval, args.poll_max_interval, options.get('bucket'),
+                                            args.monitor_errors, args.monitor_wait)
+    options['recorder_size'] = args.flight_recorder
+    if args.results:
+        options['results'] = ResultSink(shard_path(args.results, shard, shards), args.results_batch,
+                                        args.results_interval)
+    options['overlap_steps'] = args.overlap_steps
+    if args.snapshots:
+        options['snapshots'] = SessionSnapshots(args.snapshots, args.snapshot_max_age)
+    if args.retry_budget:
+        options['retries'] = Retries(args.retry_budget, args.breaker_threshold, args.breaker_reset)
+    if args.checkpoints:
+        options['checkpoints'] = StepCheckpoints(args.checkpoints, args.checkpoint_max_age)
+    index = AccountIndex(args.csv)
+    index.report()
+    status = AccountStatus(args.status) if args.status else None
+    lag = LoopLagMonitor(args.lag_interval, args.slow_callback) if args.lag_monitor else None
+    profiler = None
+    if args.profile:
+        profiler = Profiler(shard_path(args.profile, shard, shards), args.profile_mode, args.profile_interval)
+    if args.uvloop:
+        use_uvloop()
+    try:
+        return asyncio.run(main(index, options, args.concurrency, args.deadline, shard, shards, args.sharding, status,
+                                lag, profiler))
+    finally:
+        options['parser'].shutdown()
+        if status is not None:
+            status.close()
+        if args.metrics:
+            options['metrics'].export(shard_path(args.metrics, shard, shards))
+        pipeline.report()
+        pipeline.stop()
+
+
+def run_shards(args):
+    # every shard is a process with its own loop, scheduler, executor and pool;
+    # the index is built and saved before the pool starts, the shards load its file and build their own only
+    # when it could not be saved
+    AccountIndex(args.csv).report()
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = [executor.submit(run_process, args, shard, args.workers) for shard in range(args.workers)]
+        shard_stats = [f.result() for f in futures]
+    report_shards(shard_stats)
 
 
 if __name__ == '__main__':
     parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
     parser.add_argument('csv', type=FileType('r'), help='Absolute or relative to the current working directory path of a csv file')
-    parser.add_argument('--timeout', type=int,  default=TIMEOUT, help='Polling time in seconds to wait for a next monitoring request')
+    parser.add_argument('--monitor', action='store_true',
+                        help='Wait for the product of an account to be available after the steps, it is polled once for all '
+                             'the tasks; the page is taken from the optional product_url column of the csv, a url or a path '
+                             'of the site, the accounts without one are not monitored')
+    parser.add_argument('--monitor-wait', type=float, default=ProductMonitor.WAIT_TIMEOUT,
+                        help='Seconds a task waits for its product to be available before it fails')
+    parser.add_argument('--monitor-errors', type=int, default=ProductMonitor.MAX_ERRORS,
+                        help='Failed polls of a product in a row which fail the tasks waiting for it')
+    parser.add_argument('--timeout', type=int,  default=TIMEOUT, help='Polling time in seconds to wait for a next monitoring request, adapted to the changes of a product')
+    parser.add_argument('--poll-min-interval', type=float, default=ProductMonitor.MIN_INTERVAL,
+                        help='Seconds between the polls of a product which changes often')
+    parser.add_argument('--poll-max-interval', type=float, default=ProductMonitor.MAX_INTERVAL,
+                        help='Seconds between the polls of a product which does not change')
+    parser.add_argument('--rps', type=float, default=None, help='Requests per second limit of all the tasks, no limit if omitted')
+    parser.add_argument('--index-url', default=None, help='Origin to send the requests to instead of the real site, e.g. a stub.py server')
+    parser.add_argument('--clock-warp', type=float, default=1,
+                        help='Times the delays and the polling run faster than the real time, '
+                             'the reported durations count the delays in full and the rest in its real time')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes the csv rows are sharded across')
+    parser.add_argument('--sharding', default=AccountIndex.HASH, choices=AccountIndex.SHARDINGS,
+                        help='How the csv rows are split between the workers, by the hash of the login or by ranges')
+    parser.add_argument('--status', default=None,
+                        help='Path of a sqlite database to mark the finished accounts in, they are skipped by the next runs')
+    parser.add_argument('--concurrency', type=int, default=TaskScheduler.CONCURRENCY, help='Maximum number of tasks running at once per process')
+    parser.add_argument('--deadline', type=float, default=None, help='Seconds a task may run before it is cancelled, no limit if omitted')
+    parser.add_argument('--parse-executor', default=ParseExecutor.THREAD, choices=ParseExecutor.KINDS,
+                        help='Where html and json of the pages are parsed, outside of the event loop for thread and process')
+    parser.add_argument('--parse-workers', type=int, default=None, help='Parse executor size, the executor default if omitted')
+    parser.add_argument('--parse-cache', type=int, default=ParseCache.ENTRIES,
+                        help='Number of the extracted results of the pages kept by their hash, 0 to disable')
+    parser.add_argument('--parse-cache-bytes', type=int, default=ParseCache.MAX_BYTES,
+                        help='Size limit of the extracted results kept by the parse cache with their keys')
+    parser.add_argument('--pooled', action='store_true', help='Share keep-alive connections between the tasks')
+    parser.add_argument('--pool-limit', type=int, default=ConnectionPool.LIMIT, help='Total connections limit of the shared pool')
+    parser.add_argument('--pool-limit-per-host', type=int, default=ConnectionPool.LIMIT_PER_HOST,
+                        help='Connections limit per host of the shared pool')
+    parser.add_argument('--dns-ttl', type=int, default=ConnectionPool.DNS_TTL, help='Seconds to cache resolved hosts in the shared pool')
+    parser.add_argument('--metrics', default=None,
+                        help='Path to export the request phase histograms to, prometheus text for .prom, json otherwise')
+    parser.add_argument('--flight-recorder', type=int, nargs='?', const=FlightRecorder.SIZE, default=0,
+                        help='Number of the last requests of a task logged when it fails, '
+                             f'{FlightRecorder.SIZE} if given without one')
+    parser.add_argument('--results', default=None,
+                        help='Path of a file to append the outcomes of the tasks to, csv for .csv, json lines otherwise')
+    parser.add_argument('--results-batch', type=int, default=ResultSink.BATCH_SIZE,
+                        help='Outcomes written to the results file at once')
+    parser.add_argument('--results-interval', type=float, default=ResultSink.FLUSH_INTERVAL,
+                        help='Seconds an outcome may wait for its batch before it is written')
+    parser.add_argument('--snapshots', default=None, help='Directory to keep the logged in sessions in to skip the next logins')
+    parser.add_argument('--snapshot-max-age', type=int, default=SessionSnapshots.MAX_AGE,
+                        help='Seconds a session snapshot is used for before a full login')
+    parser.add_argument('--retry-budget', type=int, default=Retries.BUDGET,
+                        help='Retries a task may do across all of its requests, 0 to disable the retries')
+    parser.add_argument('--breaker-threshold', type=int, default=Retries.THRESHOLD,
+                        help='Failures in a row which open the circuit of an endpoint for all the tasks')
+    parser.add_argument('--breaker-reset', type=float, default=Retries.RESET_TIMEOUT,
+                        help='Seconds an open circuit rejects the requests before one is let through')
+    parser.add_argument('--checkpoints', default=None,
+                        help='Directory to keep the completed steps of the tasks in to resume the failed ones from')
+    parser.add_argument('--checkpoint-max-age', type=int, default=StepCheckpoints.MAX_AGE,
+                        help='Seconds the completed steps of a task are resumed from')
+    parser.add_argument('--overlap-steps', action='store_true',
+                        help='Run the flow steps that do not depend on each other at the same time')
+    parser.add_argument('--lag-monitor', action='store_true',
+                        help='Sample the event loop lag and tell the steps holding the loop, the loop runs in its slower debug mode')
+    parser.add_argument('--lag-interval', type=float, default=LoopLagMonitor.INTERVAL,
+                        help='Seconds between the samples of the event loop lag')
+    parser.add_argument('--slow-callback', type=float, default=LoopLagMonitor.SLOW_CALLBACK,
+                        help='Seconds a callback may hold the loop before it is reported, 0 to only sample the lag')
+    parser.add_argument('--profile', default=None,
+                        help='Path prefix of the .pstats profile of the tasks, sampling adds a .collapsed one with the stacks by step for the flame graphs')
+    parser.add_argument('--profile-mode', default=Profiler.DETERMINISTIC, choices=Profiler.KINDS,
+                        help='Every call profiled, or the stacks of the loop thread sampled for the long runs')
+    parser.add_argument('--profile-interval', type=float, default=Profiler.INTERVAL,
+                        help='Seconds between the samples of the sampling profiler')
+    parser.add_argument('--uvloop', action='store_true', help='Run the tasks on uvloop if it is installed')
     parser.add_argument('--log-level', default='info', choices=list(n.lower() for n in logging._nameToLevel), help="Set the logging level")
+    parser.add_argument('--log-queue', action='store_true',
+                        help='Format and write the log records in a thread instead of the event loop')
+    parser.add_argument('--log-json', action='store_true', help='Write the log records as json lines')
+    parser.add_argument('--log-sample', action='append', metavar='SOURCE=FRACTION',
+                        help='Fraction of the info records of a module or logger to keep, e.g. api=0.1')
+    parser.add_argument('--log-rate-limit', action='append', metavar='SOURCE=PER_SECOND',
+                        help='Info records of each message of a module or logger to keep per second, e.g. run=50')
     args = parser.parse_args()
+    # the shards reopen the file by its path
+    args.csv.close()
+    args.csv = args.csv.name
 
-    logging.basicConfig(level=logging._nameToLevel[args.log_level.upper()], stream=sys.stdout,
-                        format='[%(asctime)s %(levelname)s %(ctx)s] %(message)s', datefmt='%m-%d %H:%M:%S')
-    # logging.setLogRecordFactory(ContextLogRecord)
-    asyncio.run(main(args.csv))
\ No newline at end of file
+    if args.workers > 1:
+        pipeline = configure_logging(args)
+        try:
+            run_shards(args)
+        finally:
+            pipeline.stop()
+    else:
+        run_process(args)
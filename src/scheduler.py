@@ -0,0 +1,163 @@
+import time
+import asyncio
+import logging
+
+from aiohttp import TraceConfig
+
+from utils import fork_time, get_clock, limit_time, now, shared_now, sleep_for
+
+
+def _login(row):
+    # the csv rows are dicts, the rows of the account index are records
+    return row['login'] if isinstance(row, dict) else row.login
+
+
+class TaskScheduler:
+    CONCURRENCY = 10
+
+    def __init__(self, run_flow, concurrency=CONCURRENCY, deadline=None):
+        self.run_flow = run_flow
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.elapsed = 0
+        self.real_elapsed = 0
+
+    @property
+    def finished(self):
+        return self.succeeded + self.failed + self.timed_out
+
+    async def run(self, rows):
+        # the queue is bounded, so rows are read only as fast as the workers take them
+        queue = asyncio.Queue(self.concurrency)
+        workers = [asyncio.create_task(self._work(queue)) for _ in range(self.concurrency)]
+        started, real_started = now(), time.monotonic()
+        self._last_finished = started
+        try:
+            for row in rows:
+                await queue.put(row)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            # the workers run on times of their own under a warped clock, the run is as long as the longest
+            self.elapsed = max(now(), self._last_finished) - started
+            self.real_elapsed = time.monotonic() - real_started
+
+    async def _work(self, queue):
+        fork_time()
+        while True:
+            row = await queue.get()
+            if row is None:
+                return
+            try:
+                if not await self._run_flow(row):
+                    self.timed_out += 1
+                    logging.error('task for %s exceeded the %s s deadline', _login(row), self.deadline)
+                    continue
+            except Exception:
+                self.failed += 1
+            else:
+                self.succeeded += 1
+            finally:
+                self._last_finished = max(self._last_finished, now())
+
+    async def _run_flow(self, row):
+        # False if the flow ran into the deadline, its own errors are raised, a request timeout among them
+        flow = asyncio.ensure_future(self.run_flow(row))
+        if self.deadline is None:
+            await flow
+            return True
+        started = now()
+        # a warped sleep of the flow cancels it at the deadline, the wait covers the real time of the rest
+        limit_time(started + self.deadline, flow.cancel)
+        try:
+            while not flow.done() and now() - started < self.deadline:
+                await asyncio.wait({flow}, timeout=self.deadline - (now() - started))
+        finally:
+            limit_time(None, None)
+            if not flow.done():
+                flow.cancel()
+                await asyncio.wait({flow})
+        if flow.cancelled():
+            return False
+        flow.result()
+        return True
+
+    @property
+    def stats(self):
+        return {'succeeded': self.succeeded, 'failed': self.failed, 'timed_out': self.timed_out,
+                'elapsed': self.elapsed, 'real_elapsed': self.real_elapsed}
+
+    def report(self):
+        report_stats(self.stats)
+
+
+class TokenBucket:
+    # a requests per second budget of the whole process, taken by every request of the sessions it is attached to
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.tokens = self.burst
+        self.updated = shared_now()
+        self.acquired = 0
+        self.waited = 0
+        self.wait_time = 0
+        # created in the running loop, the bucket is made before it
+        self._lock = None
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+
+    def _refill(self):
+        # shared by the flows, so on the shared time
+        current = shared_now()
+        self.tokens = min(self.burst, self.tokens + (current - self.updated) * self.rate)
+        self.updated = current
+
+    async def acquire(self):
+        # the waiters are served in turn
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                self.waited += 1
+                self.wait_time += delay
+                await sleep_for(delay)
+                self._refill()
+            self.tokens -= 1
+            self.acquired += 1
+
+    async def _on_request_start(self, session, ctx, params):
+        await self.acquire()
+
+    def report(self):
+        logging.info('request budget of %s/s: %s requests, %s waited %.1f s in total',
+                     self.rate, self.acquired, self.waited, self.wait_time)
+
+
+def report_stats(stats, name='all'):
+    finished = stats['succeeded'] + stats['failed'] + stats['timed_out']
+    rate = finished / stats['elapsed'] * 60 if stats['elapsed'] else 0
+    # the elapsed time is a simulated one under a warped clock
+    real = f' (real {stats["real_elapsed"]:.1f} s)' if get_clock().factor != 1 else ''
+    logging.info('%s: %s flows in %.1f s%s (%.1f flows/min): %s succeeded, %s failed, %s timed out',
+                 name, finished, stats['elapsed'], real, rate, stats['succeeded'], stats['failed'], stats['timed_out'])
+
+
+def report_shards(shard_stats):
+    total = {'succeeded': 0, 'failed': 0, 'timed_out': 0, 'elapsed': 0, 'real_elapsed': 0}
+    for shard, stats in enumerate(shard_stats):
+        report_stats(stats, f'shard {shard}')
+        for key in ('succeeded', 'failed', 'timed_out'):
+            total[key] += stats[key]
+        # shards run in parallel, so the slowest one is the wall time
+        total['elapsed'] = max(total['elapsed'], stats['elapsed'])
+        total['real_elapsed'] = max(total['real_elapsed'], stats['real_elapsed'])
+    report_stats(total)
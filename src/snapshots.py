@@ -0,0 +1,83 @@
+import os
+import json
+import time
+import logging
+from http.cookies import SimpleCookie
+
+from yarl import URL
+
+from utils import account_key
+
+
+def _write_private(path, text):
+    # the cookies and the token log the account in, so only the owner reads them
+    tmp_path = f'{path}.tmp'
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+class SessionSnapshots:
+    MAX_AGE = 12 * 60 * 60
+
+    def __init__(self, directory, max_age=MAX_AGE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.ages = []
+
+    def _paths(self, login):
+        path = os.path.join(self.directory, account_key(login))
+        return f'{path}.json', f'{path}.cookies'
+
+    def load(self, login, cookie_jar):
+        # fills the cookie jar and returns the saved tokens, None if there is no fresh snapshot
+        meta_path, cookies_path = self._paths(login)
+        try:
+            with open(meta_path) as file:
+                snapshot = json.load(file)
+            age = time.time() - snapshot['saved']
+            if age > self.max_age:
+                self.stale += 1
+                return None
+            with open(cookies_path) as file:
+                cookies = json.load(file)
+            for cookie in cookies:
+                morsel = SimpleCookie({cookie['name']: cookie['value']})[cookie['name']]
+                for attribute in ('domain', 'path', 'expires'):
+                    morsel[attribute] = cookie[attribute]
+                # a cookie is accepted only from a host of its domain
+                cookie_jar.update_cookies({cookie['name']: morsel}, URL.build(scheme='https',
+                                                                              host=cookie['domain'].lstrip('.')))
+        except (OSError, ValueError, KeyError, TypeError):
+            self.misses += 1
+            return None
+        snapshot['age'] = age
+        return snapshot
+
+    def hit(self, snapshot):
+        self.hits += 1
+        self.ages.append(snapshot['age'])
+
+    def invalidate(self, login):
+        self.stale += 1
+        for path in self._paths(login):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def save(self, login, cookie_jar, xsrf, client_id):
+        meta_path, cookies_path = self._paths(login)
+        # json rather than the pickle of the cookie jar, loading a file must not run any code
+        _write_private(cookies_path, json.dumps([{'name': morsel.key, 'value': morsel.value, 'domain': morsel['domain'],
+                                                  'path': morsel['path'], 'expires': morsel['expires']}
+                                                 for morsel in cookie_jar]))
+        _write_private(meta_path, json.dumps({'saved': time.time(), 'xsrf': xsrf, 'client_id': client_id}))
+
+    def report(self):
+        age = f', age avg {sum(self.ages) / len(self.ages) / 60:.1f} min max {max(self.ages) / 60:.1f} min' if self.ages else ''
+        logging.info('session snapshots: %s hits, %s misses, %s stale%s', self.hits, self.misses, self.stale, age)
@@ -0,0 +1,127 @@
+import asyncio
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Tuple
+
+from utils import name_task, now
+
+
+current_step = ContextVar('current_step', default=None)
+
+
+@dataclass(frozen=True)
+class Step:
+    name: str
+    func: Callable
+    requires: Tuple[str, ...] = ()
+    provides: Tuple[str, ...] = ()
+
+
+@dataclass
+class StepTimings:
+    started: float = 0
+    spans: dict = field(default_factory=dict)
+    critical_path: list = field(default_factory=list)
+    failed: str = None
+
+    @property
+    def durations(self):
+        return {name: end - start for name, (start, end) in self.spans.items()}
+
+    @property
+    def wall(self):
+        return max((end for _, end in self.spans.values()), default=self.started) - self.started
+
+    @property
+    def critical(self):
+        durations = self.durations
+        return sum(durations[name] for name in self.critical_path)
+
+
+class StepGraph:
+    # the steps are declared in the order they run one by one, which is a topological one
+
+    def __init__(self, steps, initial=()):
+        self.steps = steps
+        available = set(initial)
+        for step in steps:
+            missing = set(step.requires) - available
+            if missing:
+                raise ValueError(f'{step.name} requires {", ".join(sorted(missing))} not provided by a previous step')
+            available.update(step.provides)
+        self.providers = {key: step.name for step in steps for key in step.provides}
+        self.names = [step.name for step in steps]
+
+    def dependencies(self, step):
+        return {self.providers[key] for key in step.requires if key in self.providers}
+
+    async def _run_step(self, step, owner, data, timings, on_step):
+        token = current_step.set(step.name)
+        # the slow callbacks of the loop are told by the name of their task, ctx:step
+        name_task(f'{asyncio.current_task().get_name().partition(":")[0]}:{step.name}')
+        try:
+            started = now()
+            outputs = await step.func(owner, data)
+            timings.spans[step.name] = started, now()
+        except BaseException:
+            timings.failed = timings.failed or step.name
+            raise
+        finally:
+            current_step.reset(token)
+        if outputs:
+            data.update(outputs)
+        if on_step is not None:
+            on_step(step, data)
+
+    async def run(self, owner, data, overlap=False, completed=(), on_step=None, timings=None):
+        # the completed steps are skipped, their outputs are expected to be in the data already
+        timings = timings or StepTimings()
+        timings.started = now()
+        pending = [step for step in self.steps if step.name not in completed]
+        if overlap:
+            await self._run_overlapped(pending, owner, data, timings, on_step)
+        else:
+            for step in pending:
+                await self._run_step(step, owner, data, timings, on_step)
+        timings.critical_path = self.critical_path(timings)
+        return timings
+
+    async def _run_overlapped(self, pending, owner, data, timings, on_step):
+        pending = list(pending)
+        running = {}
+        ctx = asyncio.current_task().get_name().partition(':')[0]
+        try:
+            while pending or running:
+                for step in [s for s in pending if all(key in data for key in s.requires)]:
+                    pending.remove(step)
+                    future = asyncio.ensure_future(self._run_step(step, owner, data, timings, on_step))
+                    future.set_name(f'{ctx}:{step.name}')
+                    running[future] = step
+                if not running:
+                    raise ValueError(f'{", ".join(s.name for s in pending)} can not be run, requirements are missing')
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    future.result()
+        finally:
+            for future in running:
+                future.cancel()
+
+    def critical_path(self, timings):
+        # the longest chain of dependent steps by their durations
+        durations = timings.durations
+        longest = {}
+        previous = {}
+        for step in self.steps:
+            if step.name not in durations:
+                continue
+            deps = [name for name in self.dependencies(step) if name in longest]
+            before = max(deps, key=longest.get, default=None)
+            previous[step.name] = before
+            longest[step.name] = durations[step.name] + (longest[before] if before else 0)
+        path = []
+        name = max(longest, key=longest.get, default=None)
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1]
@@ -0,0 +1,191 @@
+import os
+import asyncio
+import hashlib
+import logging
+from collections import Counter
+from random import random, uniform
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from aiohttp import web
+from yarl import URL
+
+
+# by the location of the module, the same directory whatever the working one
+FIXTURES_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'files', 'html'))
+FIXTURES = {
+    'accessories': 'accessories.html',
+    'product': 'product, only size.html',
+    'cart': 'cart.html',
+    'address': 'checkout/address.html',
+}
+CHUNK_SIZE = 16 * 1024
+
+
+class ZalandoStub:
+    # serves the routes used by ZalandoAPI from the html fixtures, see ZalandoAPI.set_index_url
+
+    def __init__(self, fixtures_dir=FIXTURES_DIR, latency=(0, 0), error_rate=0, bandwidth=None):
+        self.pages = {}
+        for name, path in FIXTURES.items():
+            with open(f'{fixtures_dir}/{path}', 'rb') as file:
+                self.pages[name] = file.read()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bandwidth = bandwidth
+        self.products = {}
+        self.requests = Counter()
+        self.errors = 0
+        self.url = None
+        self._runner = None
+
+        self.app = web.Application(middlewares=[self._conditions])
+        self.app.router.add_routes([
+            web.get('/login', self.login),
+            web.route('*', '/resources/{tail:.*}', self.empty),
+            web.get('/api/reef/login/schema', self.json({})),
+            web.post('/api/reef/login', self.json({'status': 'ok'})),
+            web.post('/api/consents', self.consents),
+            web.get('/myaccount', self.html(b'<html><body>my account</body></html>')),
+            web.get('/mens-hats-caps/__size-One---size/', self.page('accessories')),
+            web.post('/api/pdp/sizereco', self.json({})),
+            web.get('/api/pdp/check-wishlist', self.json({'isInWishlist': False})),
+            web.get('/api/customer-preference-api/preference-types/brands', self.json([])),
+            web.post('/api/pdp/cart', self.json({})),
+            web.get('/api/navigation/cart-count', self.json(1)),
+            web.get('/api/cart/details', self.json({})),
+            web.get('/cart', self.page('cart')),
+            web.post('/api/cart-fragment/redeem', self.json({})),
+            web.get('/checkout/confirm', self.redirect(web.HTTPFound, '/checkout/address')),
+            web.get('/checkout/address', self.page('address')),
+            web.post('/api/checkout/address/{id}/default', self.json({})),
+            web.get('/api/checkout/next-step', self.next_step),
+            web.get('/payment/session', self.redirect(web.HTTPTemporaryRedirect, '/payment/selection')),
+            web.get('/payment/selection', self.payment_selection),
+            web.get('/payment/complete', self.redirect(web.HTTPFound, '/checkout/confirm')),
+            web.post('/api/checkout/remove-confirmation-item', self.json({})),
+            # any other page is a product one, like the links of the accessories page
+            web.get('/{product:.+\\.html}', self.product),
+        ])
+
+    @web.middleware
+    async def _conditions(self, request, handler):
+        resource = request.match_info.route.resource
+        self.requests[resource.canonical if resource else request.path] += 1
+        if self.latency[1]:
+            await asyncio.sleep(uniform(*self.latency))
+        if self.error_rate and random() < self.error_rate:
+            self.errors += 1
+            raise web.HTTPServiceUnavailable()
+        response = await handler(request)
+        if self.bandwidth and isinstance(response, web.Response) and response.body:
+            return await self._throttle(request, response)
+        return response
+
+    async def _throttle(self, request, response):
+        stream = web.StreamResponse(status=response.status, headers=response.headers)
+        stream.content_length = len(response.body)
+        await stream.prepare(request)
+        body = response.body
+        for start in range(0, len(body), CHUNK_SIZE):
+            chunk = body[start:start + CHUNK_SIZE]
+            await stream.write(chunk)
+            await asyncio.sleep(len(chunk) / self.bandwidth)
+        await stream.write_eof()
+        return stream
+
+    @staticmethod
+    def json(data):
+        async def handler(request):
+            return web.json_response(data)
+        return handler
+
+    @staticmethod
+    def html(body):
+        async def handler(request):
+            return web.Response(body=body, content_type='text/html', charset='utf-8')
+        return handler
+
+    def page(self, name):
+        return self.html(self.pages[name])
+
+    async def product(self, request):
+        # answers the conditional requests of the monitoring, the pages of single products are set by set_product
+        body = self.products.get(request.path, self.pages['product'])
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=body, content_type='text/html', charset='utf-8', headers={'ETag': etag})
+
+    def set_product(self, path, body):
+        self.products[path] = body
+
+    @staticmethod
+    def redirect(exc, location):
+        async def handler(request):
+            raise exc(location)
+        return handler
+
+    async def empty(self, request):
+        await request.read()
+        return web.Response(status=201 if request.method == 'POST' else 200)
+
+    async def login(self, request):
+        response = web.Response(body=b'<html><body>login</body></html>', content_type='text/html', charset='utf-8',
+                                headers={'x-zalando-child-request-id': 'stub-child-request-id'})
+        response.set_cookie('frsx', 'stub-xsrf-token')
+        response.set_cookie('Zalando-Client-Id', 'stub-client-id')
+        return response
+
+    async def consents(self, request):
+        return web.json_response({}, headers={'x-zalando-child-request-id': 'stub-child-request-id'})
+
+    async def next_step(self, request):
+        return web.json_response({'url': str(self.url / 'payment/session')})
+
+    async def payment_selection(self, request):
+        # absolute, as ZalandoAPI.payment_complete takes the host from it
+        raise web.HTTPSeeOther(str(self.url / 'payment/complete'))
+
+    async def start(self, host='localhost', port=0):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = URL.build(scheme='http', host=host, port=port)
+        logging.info('stub is serving on %s', self.url)
+        return self.url
+
+    def report(self):
+        logging.info('stub served %s requests, %s errors', sum(self.requests.values()), self.errors)
+
+    async def close(self):
+        await self._runner.cleanup()
+
+
+async def serve(args):
+    stub = ZalandoStub(args.fixtures, (args.min_latency, args.max_latency), args.error_rate, args.bandwidth)
+    await stub.start(args.host, args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        stub.report()
+        await stub.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--host', default='localhost', help='Interface to listen on, an ip address is not usable for the cookies')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='Directory of the html fixtures')
+    parser.add_argument('--min-latency', type=float, default=0, help='Minimum seconds added to every response')
+    parser.add_argument('--max-latency', type=float, default=0, help='Maximum seconds added to every response')
+    parser.add_argument('--error-rate', type=float, default=0, help='Fraction of requests answered with 503')
+    parser.add_argument('--bandwidth', type=int, default=None, help='Bytes per second a response body is sent with')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s %(levelname)s] %(message)s', datefmt='%m-%d %H:%M:%S')
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
@@ -1,9 +1,19 @@
+import time
 import logging
 from pprint import pformat
+from collections import deque
+from types import SimpleNamespace
+
+from aiohttp import ClientResponseError, TraceConfig
 
 from utils import cookies_repr
 
 
+async def _body(response):
+    # read once, the page methods get the same bytes, decoded here only for the log
+    return (await response.read()).decode(response.charset or 'utf-8', errors='replace')
+
+
 async def on_request_chunk_sent(session, trace_config_ctx, params):
      logging.debug('Request body chunk: %s', params.chunk.decode())
 
@@ -16,7 +26,7 @@ async def on_request_redirect(session, trace_config_ctx, params):
     logging.debug('Request Headers:\n' + pformat(params.response.request_info.headers.items()))
     logging.debug('%s %s', params.response.status, params.response.reason)
     logging.debug('Response Headers:\n' + pformat(params.response.headers.items()))
-    logging.debug('Response Body:\n' + await params.response.text())
+    logging.debug('Response Body:\n' + await _body(params.response))
     logging.debug('Session Cookies:\n' + cookies_repr(session.cookie_jar))
 
 
@@ -28,4 +38,71 @@ async def on_request_end(session, trace_config_ctx, params):
     logging.debug('Request Headers:\n' + pformat(params.response.request_info.headers.items()))
     logging.debug('%s %s', params.response.status, params.response.reason)
     logging.debug('Response Headers:\n' + pformat(params.response.headers.items()))
-    logging.debug('Response Body:\n' + await params.response.text())
\ No newline at end of file
+    logging.debug('Response Body:\n' + await _body(params.response))
+
+
+def debug_trace_config():
+    trace_config = TraceConfig()
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace_config.on_request_redirect.append(on_request_redirect)
+    return trace_config
+
+
+class FlightRecorder:
+    # keeps the last requests of a task and logs them only if the task fails, it copies every body so it is opt-in
+    SIZE = 20
+    BODY_LIMIT = 2048
+
+    def __init__(self, size=SIZE, body_limit=BODY_LIMIT):
+        self.records = deque(maxlen=size)
+        self.body_limit = body_limit
+        self.trace_config = TraceConfig()
+        self.trace_config.on_request_start.append(self._on_request_start)
+        self.trace_config.on_request_redirect.append(self._on_request_redirect)
+        self.trace_config.on_request_end.append(self._on_request_end)
+        self.trace_config.on_request_exception.append(self._on_request_exception)
+        self.trace_config.on_response_chunk_received.append(self._on_response_chunk_received)
+
+    def _start(self, ctx, method, url, headers):
+        ctx.record = SimpleNamespace(started=time.time(), method=method, url=url, request_headers=headers,
+                                     status=None, reason=None, response_headers=None, body=bytearray(), error=None)
+        self.records.append(ctx.record)
+
+    def _response(self, ctx, response):
+        ctx.record.status = response.status
+        ctx.record.reason = response.reason
+        ctx.record.response_headers = response.headers
+
+    async def _on_request_start(self, session, ctx, params):
+        self._start(ctx, params.method, params.url, params.headers)
+
+    async def _on_request_redirect(self, session, ctx, params):
+        self._response(ctx, params.response)
+        # the next hop is a record of its own
+        self._start(ctx, params.method, params.response.headers.get('location'), None)
+
+    async def _on_request_end(self, session, ctx, params):
+        self._response(ctx, params.response)
+        ctx.record.request_headers = params.response.request_info.headers
+
+    async def _on_request_exception(self, session, ctx, params):
+        ctx.record.error = repr(params.exception)
+        # raise_for_status fails the request before its end, the status is only on the error
+        if isinstance(params.exception, ClientResponseError):
+            ctx.record.status = params.exception.status
+            ctx.record.reason = params.exception.message
+
+    async def _on_response_chunk_received(self, session, ctx, params):
+        body = ctx.record.body
+        if len(body) < self.body_limit:
+            body += params.chunk[:self.body_limit - len(body)]
+
+    def dump(self):
+        for record in self.records:
+            logging.error('Recorded %s %s at %s: %s %s%s\nRequest Headers:\n%s\nResponse Headers:\n%s\nResponse Body:\n%s',
+                          record.method, record.url, time.strftime('%H:%M:%S', time.localtime(record.started)),
+                          record.status, record.reason, f' {record.error}' if record.error else '',
+                          pformat(list(record.request_headers.items())) if record.request_headers else '',
+                          pformat(list(record.response_headers.items())) if record.response_headers else '',
+                          record.body.decode(errors='replace'))
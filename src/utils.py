@@ -1,5 +1,10 @@
+import time
 import asyncio
+import hashlib
 from random import randint
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable
 
 
 class Delay:
@@ -26,13 +31,151 @@ class Delay:
         return delay * 10 ** -3
 
 
+class Clock:
+    # the time of the delays and of the scheduling code, see set_clock
+    factor = 1
+
+    def time(self):
+        return time.monotonic()
+
+    def shared_time(self):
+        return time.monotonic()
+
+    def real_seconds(self, seconds):
+        return seconds / self.factor
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(self.real_seconds(seconds))
+
+    async def wait_for(self, awaitable, timeout):
+        return await asyncio.wait_for(awaitable, self.real_seconds(timeout) if timeout is not None else None)
+
+    def fork(self):
+        pass
+
+    def limit(self, deadline, expire):
+        pass
+
+
+@dataclass
+class Timeline:
+    # the simulated seconds the sleeps of a flow did not take
+    skipped: float = 0
+    # a sleep does not pass the deadline, it calls expire there
+    deadline: float = None
+    expire: Callable = None
+
+
+_timeline = ContextVar('timeline', default=None)
+
+
+class WarpClock(Clock):
+    # sleeps factor times faster than the real time, e.g. to run the flows with their delays against a stub;
+    # the time of a flow is the real one plus the whole of its sleeps, so its durations are the ones of a real run,
+    # the state shared by the flows (the monitor schedule, the breakers, the request budget) runs factor times faster
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.origin = time.monotonic()
+        self.timeline = Timeline()
+
+    def _timeline(self):
+        return _timeline.get() or self.timeline
+
+    def time(self):
+        return time.monotonic() + self._timeline().skipped
+
+    def shared_time(self):
+        return self.origin + (time.monotonic() - self.origin) * self.factor
+
+    async def sleep(self, seconds):
+        timeline = self._timeline()
+        until = self.time() + seconds
+        if timeline.deadline is not None and until >= timeline.deadline:
+            # the flow is cancelled at its deadline rather than after the time the sleep skipped
+            await self._sleep_until(timeline, timeline.deadline)
+            timeline.expire()
+        await self._sleep_until(timeline, until)
+
+    async def _sleep_until(self, timeline, until):
+        await asyncio.sleep(self.real_seconds(max(0, until - self.time())))
+        # the sleeps of the tasks of a flow may overlap, the time is skipped once
+        timeline.skipped = max(timeline.skipped, until - time.monotonic())
+
+    async def wait_for(self, awaitable, timeout):
+        # a wait on the shared time is as long for the flow
+        started = time.monotonic()
+        try:
+            return await super().wait_for(awaitable, timeout)
+        finally:
+            self._timeline().skipped += (time.monotonic() - started) * (self.factor - 1)
+
+    def fork(self):
+        # a time of its own for the current task and the tasks it creates, from the time of its parent
+        _timeline.set(Timeline(self._timeline().skipped))
+
+    def limit(self, deadline, expire):
+        timeline = self._timeline()
+        timeline.deadline, timeline.expire = deadline, expire
+
+
+_clock = Clock()
+
+
+def set_clock(clock: Clock):
+    global _clock
+    _clock = clock
+
+
+def get_clock():
+    return _clock
+
+
+def now():
+    return _clock.time()
+
+
+def shared_now():
+    return _clock.shared_time()
+
+
+def real_seconds(seconds):
+    return _clock.real_seconds(seconds)
+
+
+async def sleep_for(seconds):
+    await _clock.sleep(seconds)
+
+
+async def wait_for(awaitable, timeout):
+    return await _clock.wait_for(awaitable, timeout)
+
+
+def fork_time():
+    _clock.fork()
+
+
+def limit_time(deadline, expire):
+    _clock.limit(deadline, expire)
+
+
 async def sleep(delay: Delay):
-    await asyncio.sleep(Delay.make(delay))
+    await _clock.sleep(Delay.make(delay))
+
+
+def name_task(name):
+    # after the running callback, so a slow one is still told by the name the task has resumed with
+    asyncio.get_running_loop().call_soon(asyncio.current_task().set_name, name)
 
 
 def make_ctx(api):
     return hex(hash(api)).lstrip('-')
 
 
+def account_key(login):
+    # stable between the runs, unlike make_ctx
+    return hashlib.sha1(login.lower().encode()).hexdigest()
+
+
 def cookies_repr(cookie_jar, sep='\n'):
     return f'{sep}'.join(c.output(header='') for c in cookie_jar)
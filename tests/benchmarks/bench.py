@@ -0,0 +1,253 @@
+# run from the src directory like run.py: PYTHONPATH=. python ../tests/benchmarks/bench.py
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import tracemalloc
+from unittest.mock import patch
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from api import ZalandoAPI
+from executors import ParseExecutor
+from logs import LoggingPipeline
+from parsing import PARSE_CACHE, find_product_params, find_address_id, find_rand_product_url, find_redeem_params
+from run import ptask_id, run_flow
+from stub import ZalandoStub, FIXTURES_DIR
+from utils import Delay
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+TOLERANCE = 0.2
+# the bytes of the page with the charset of the response, what the flows parse
+EXTRACTORS = {
+    'find_product_params': (lambda body: find_product_params(body, 'utf-8'), 'product, only size.html'),
+    'find_product_params[full dom]': (lambda body: find_product_params(body, 'utf-8', streaming=False),
+                                      'product, only size.html'),
+    'find_redeem_params': (lambda body: find_redeem_params(body, 'utf-8'), 'cart.html'),
+    'find_address_id': (lambda body: find_address_id(body, 'utf-8'), 'checkout/address.html'),
+    'find_rand_product_url': (lambda body: find_rand_product_url(body, 'utf-8'), 'accessories.html'),
+}
+# the same document again, what the parse cache saves
+CACHED_EXTRACTORS = ('find_product_params', 'find_rand_product_url')
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def summary(samples, allocated=None):
+    result = {'ops': len(samples) / sum(samples),
+              'p50': percentile(samples, 0.5),
+              'p99': percentile(samples, 0.99)}
+    if allocated is not None:
+        result['allocated'] = allocated
+    return result
+
+
+def allocated_by(func, *args):
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+def bench_extractor(func, text, number):
+    samples = []
+    for _ in range(number):
+        started = time.perf_counter()
+        func(text)
+        samples.append(time.perf_counter() - started)
+    return summary(samples, allocated_by(func, text))
+
+
+def bench_extractors(fixtures, number):
+    results = {}
+    for name, (func, path) in EXTRACTORS.items():
+        with open(f'{fixtures}/{path}', 'rb') as file:
+            text = file.read()
+        with patch.object(PARSE_CACHE, 'entries', 0):
+            results[name] = bench_extractor(func, text, number)
+        if name in CACHED_EXTRACTORS:
+            PARSE_CACHE.clear()
+            func(text)
+            results[f'{name}[cached]'] = bench_extractor(func, text, number)
+    return results
+
+
+SIZERECO_ARGS = ('xsrf', 'https://www.zalando.se/product.html', 'PO252E00N-B110ONE000', 'headgear', 'MD1', 'hash')
+
+
+def legacy_sizereco_request(xsrf, referer, simple_sku, silhouette, version, chash):
+    # how the request was built before the endpoint specs, the body serialization is the one of aiohttp json=
+    headers = {
+        'Accept': ZalandoAPI.MIME_JSON,
+        'Referer': str(referer),
+        'Origin': str(ZalandoAPI.INDEX_URL.origin()),
+        'x-xsrf-token': xsrf,
+    }
+    data = {
+        "configSku": simple_sku.rstrip('0ONE000'),
+        "isSizeFlagApplicable": False,
+        "isSizeRecoApplicable": False,
+        "isSizeTableApplicable": True,
+        "isSizeFinderApplicable": False,
+        "customerHash": chash,
+        "availableSimpleSkus": [simple_sku],
+        "silhouette": silhouette,
+        "targetGroup": "UNISEX",
+        "version": version,
+        "tableBounds": {"filters": [{"targetGroups": ["MALE", "FEMALE", "UNISEX"], "filterName": "matchStrictEqual"}],
+                        "units": [{"local": "One Size", "local_type": "SE"}]},
+        "localSizeType": "SE"
+    }
+    return headers, json.dumps(data).encode()
+
+
+def sizereco_request(xsrf, referer, simple_sku, silhouette, version, chash):
+    headers = {**ZalandoAPI.HEADERS['api_sizereco'], 'Referer': str(referer), 'x-xsrf-token': xsrf}
+    data = ZalandoAPI.SIZERECO_BODY.render(config_sku=simple_sku.rstrip('0ONE000'), chash=chash, simple_sku=simple_sku,
+                                           silhouette=silhouette, version=version)
+    return headers, data
+
+
+def bench_requests(number):
+    results = {}
+    for name, func in (('api_sizereco request[legacy]', legacy_sizereco_request),
+                       ('api_sizereco request', sizereco_request)):
+        samples = []
+        for _ in range(number):
+            started = time.perf_counter()
+            func(*SIZERECO_ARGS)
+            samples.append(time.perf_counter() - started)
+        results[name] = summary(samples, allocated_by(func, *SIZERECO_ARGS))
+    return results
+
+
+async def bench_flows(fixtures, flows):
+    stub = ZalandoStub(fixtures)
+    index_url = ZalandoAPI.INDEX_URL
+    ZalandoAPI.set_index_url(await stub.start())
+    parser = ParseExecutor()
+    samples = []
+
+    async def timed_flow(i):
+        api_data = {'login': f'login{i}', 'password': 'password', 'id': 'id', 'dcode': 'dcode', 'size': 'size'}
+        started = time.perf_counter()
+        await run_flow(api_data, parser=parser)
+        samples.append(time.perf_counter() - started)
+
+    try:
+        with patch.dict(Delay.DEFAULTS, {k: (0, 0) for k in Delay.DEFAULTS}):
+            started = time.perf_counter()
+            await asyncio.gather(*(timed_flow(i) for i in range(flows)))
+            elapsed = time.perf_counter() - started
+    finally:
+        ZalandoAPI.set_index_url(index_url)
+        await stub.close()
+    result = summary(samples)
+    # the flows run concurrently, so the throughput is the wall one
+    result['ops'] = flows / elapsed
+    return {'PurchasingTask.run': result}
+
+
+LOG_CALLS = 60
+
+
+async def log_calls(samples, i):
+    ptask_id.set(f'task-{i}')
+    for n in range(LOG_CALLS):
+        started = time.perf_counter()
+        logging.info('log call %s of %s', n, f'task-{i}')
+        samples.append(time.perf_counter() - started)
+        await asyncio.sleep(0)
+
+
+def bench_logging(tasks):
+    # the time a log call takes in the event loop, the queued records are written after the tasks
+    results = {}
+    with open(os.devnull, 'w') as devnull:
+        for name, options in (('logging', {}),
+                              ('logging[queued]', {'queued': True}),
+                              ('logging[queued json]', {'queued': True, 'json_lines': True})):
+            pipeline = LoggingPipeline(logging.INFO, devnull, **options)
+            samples = []
+
+            async def run():
+                await asyncio.gather(*(log_calls(samples, i) for i in range(tasks)))
+
+            try:
+                asyncio.run(run())
+            finally:
+                pipeline.stop()
+            results[name] = summary(samples)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result['ops'] < base['ops'] * (1 - tolerance):
+            regressions.append(f'{name}: {result["ops"]:.1f} ops/s, baseline {base["ops"]:.1f}')
+        for key in ('p50', 'allocated'):
+            if key in result and key in base and result[key] > base[key] * (1 + tolerance):
+                regressions.append(f'{name}: {key} {result[key]:.6g}, baseline {base[key]:.6g}')
+    return regressions
+
+
+def print_results(results):
+    for name, result in results.items():
+        line = (f'{name:32} {result["ops"]:10.1f} ops/s'
+                f'  p50 {result["p50"] * 10 ** 3:8.3f} ms  p99 {result["p99"] * 10 ** 3:8.3f} ms')
+        if 'allocated' in result:
+            line += f'  allocated {result["allocated"] / 1024:8.1f} KiB'
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='Directory of the html fixtures')
+    parser.add_argument('--number', type=int, default=100, help='Calls per extractor')
+    parser.add_argument('--flows', type=int, default=50, help='Concurrent flows run against the stub, 0 to skip')
+    parser.add_argument('--log-tasks', type=int, default=1000, help='Concurrent tasks logging, 0 to skip')
+    parser.add_argument('--output', default=None, help='Path of a json file to write the results to')
+    parser.add_argument('--baseline', default=BASELINE, help='Path of a json file with the results to compare with')
+    parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='Allowed relative slowdown before failing')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = bench_extractors(args.fixtures, args.number)
+    results.update(bench_requests(args.number * 100))
+    if args.flows:
+        results.update(asyncio.run(bench_flows(args.fixtures, args.flows)))
+    if args.log_tasks:
+        results.update(bench_logging(args.log_tasks))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        try:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            print(f'no baseline at {args.baseline}, run with --update-baseline to store one')
+        else:
+            regressions = compare(results, baseline, args.tolerance)
+            for regression in regressions:
+                print(f'REGRESSION {regression}')
+            sys.exit(1 if regressions else 0)
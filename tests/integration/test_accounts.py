@@ -0,0 +1,64 @@
+from accounts import Account, AccountIndex, AccountStatus
+
+
+def write_accounts(path, count):
+    with open(path, 'w') as file:
+        file.write('login,password,id,dcode,size\n')
+        for i in range(count):
+            file.write(f'login{i},"pass,{i}",product.html,dcode,One Size\n')
+
+
+def test_account_index(tmp_path):
+    path = str(tmp_path / 'accounts.csv')
+    write_accounts(path, 100)
+    index = AccountIndex(path)
+    assert index.built is not None
+    assert len(index) == 100
+    assert list(index.read([0, 99])) == [Account('login0', 'pass,0', 'product.html', 'dcode', 'One Size'),
+                                         Account('login99', 'pass,99', 'product.html', 'dcode', 'One Size')]
+
+    for sharding in AccountIndex.SHARDINGS:
+        rows = [row for shard in range(3) for row in index.shard(shard, 3, sharding)]
+        assert sorted(rows) == list(range(100))
+
+    loaded = AccountIndex(path)
+    assert loaded.built is None
+    assert loaded.offsets == index.offsets
+
+    write_accounts(path, 10)
+    assert len(AccountIndex(path)) == 10
+
+    with open(path, 'a') as file:
+        file.write('login10,"pass\n""10""",product.html,dcode,One Size\nlogin11,pass,product.html,dcode,One Size\n')
+    index = AccountIndex(path)
+    assert len(index) == 12
+    assert [account.password for account in index.read([10, 11])] == ['pass\n"10"', 'pass']
+
+
+def test_account_status(tmp_path):
+    path = str(tmp_path / 'accounts.csv')
+    write_accounts(path, 5)
+    index = AccountIndex(path)
+    status = AccountStatus(str(tmp_path / 'status.db'), batch_size=2)
+    status.complete('login1')
+    assert status.flushes == 0
+    status.complete('LOGIN3')
+    assert status.flushes == 1
+    status.complete('login4')
+    status.close()
+
+    status = AccountStatus(str(tmp_path / 'status.db'))
+    pending = [account.login for account in status.pending(index.read(range(len(index))))]
+    assert pending == ['login0', 'login2']
+    assert status.skipped == 3
+
+
+def test_account_product_url(tmp_path):
+    path = str(tmp_path / 'accounts.csv')
+    with open(path, 'w') as file:
+        file.write('login,password,id,dcode,size,product_url\n')
+        file.write('login0,pass,SKU-1,dcode,One Size,/product.html\n')
+    assert next(AccountIndex(path).read([0])).product_url == '/product.html'
+
+    write_accounts(path, 1)
+    assert next(AccountIndex(path).read([0])).product_url == ''
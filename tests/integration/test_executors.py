@@ -0,0 +1,25 @@
+import asyncio
+from contextvars import ContextVar
+
+from executors import ParseExecutor
+
+
+task_id = ContextVar('task_id', default=None)
+
+
+def current_task_id():
+    return task_id.get()
+
+
+def test_parse_executor_context():
+    for kind in (ParseExecutor.INLINE, ParseExecutor.THREAD):
+        executor = ParseExecutor(kind)
+
+        async def run():
+            task_id.set('task-1')
+            return await executor.run(current_task_id)
+
+        assert asyncio.run(run()) == 'task-1'
+        stats = executor.stats['current_task_id']
+        assert stats.calls == 1 and stats.wait >= 0
+        executor.shutdown()
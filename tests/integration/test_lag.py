@@ -0,0 +1,31 @@
+import time
+import asyncio
+
+from lag import LoopLagMonitor
+from steps import Step, StepGraph
+
+
+async def blocking(owner, data):
+    await asyncio.sleep(0)
+    time.sleep(0.1)
+
+
+async def waiting(owner, data):
+    await asyncio.sleep(0.1)
+
+
+def test_loop_lag_monitor():
+    graph = StepGraph([Step('parse', blocking), Step('wait', waiting)])
+    lag = LoopLagMonitor(interval=0.01, slow_callback=0.05)
+
+    async def run():
+        lag.start()
+        await asyncio.sleep(0.02)
+        await asyncio.create_task(graph.run([], {}), name='ctx')
+        lag.stop()
+
+    asyncio.run(run())
+    assert lag.stalls == 1
+    assert list(lag.offenders) == ['ctx:parse']
+    assert lag.steps['parse'] >= 0.1
+    assert lag.percentile(1) >= 0.05
@@ -0,0 +1,25 @@
+import io
+import json
+import logging
+
+from logs import LoggingPipeline
+
+
+def test_logging_pipeline():
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    stream = io.StringIO()
+    pipeline = LoggingPipeline(logging.INFO, stream, queued=True, json_lines=True, limits={'test_logs': 2})
+    try:
+        for i in range(5):
+            logging.info('record %s', i)
+        logging.info('another message')
+        logging.warning('kept over the limit')
+    finally:
+        pipeline.stop()
+    assert root.handlers == handlers
+    entries = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [entry['message'] for entry in entries] == ['record 0', 'record 1', 'another message',
+                                                       'kept over the limit']
+    assert entries[0]['source'] == 'test_logs'
+    assert pipeline.sampling.dropped['test_logs'] == 3
@@ -0,0 +1,53 @@
+import asyncio
+
+from aiohttp import ClientSession, web
+
+from metrics import PhaseMetrics
+
+
+async def slow_body(request):
+    response = web.StreamResponse()
+    await response.prepare(request)
+    await response.write(b'first')
+    await asyncio.sleep(0.1)
+    await response.write(b'last')
+    return response
+
+
+async def fast_body(request):
+    return web.Response(body=b'fast')
+
+
+def test_phase_metrics():
+    metrics = PhaseMetrics()
+
+    async def run():
+        app = web.Application()
+        app.add_routes([web.get('/slow', slow_body), web.get('/fast', fast_body)])
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, 'localhost', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            async with ClientSession(trace_configs=[metrics.trace_config]) as session:
+                async def get(path):
+                    async with session.get(f'http://localhost:{port}{path}') as resp:
+                        await resp.read()
+
+                # the requests of a session at once
+                await asyncio.gather(get('/slow'), get('/fast'), get('/fast'))
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+    data = metrics.as_dict()
+    assert data['/slow']['total']['count'] == 1
+    assert data['/slow']['body']['sum'] >= 0.1
+    assert data['/fast']['total']['count'] == 2
+    assert data['/fast']['body']['sum'] < 0.05
+    assert data['/fast']['ttfb']['count'] == 2
+
+    text = metrics.as_prometheus()
+    assert 'zalando_request_phase_seconds_bucket{endpoint="/slow",phase="body",le="+Inf"} 1' in text
+    assert 'zalando_request_phase_seconds_count{endpoint="/fast",phase="total"} 2' in text
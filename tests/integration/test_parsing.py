@@ -1,9 +1,10 @@
-from parsing import (find_product_params, find_address_id, find_rand_product_url,
-                     find_redeem_params)
+from parsing import (find_product_params, find_product_units, find_address_id, find_rand_product_url,
+                     find_redeem_params, ParseCache, ParsedPage)
+from stub import FIXTURES_DIR
 
 
 def test_find_product_params():
-    with open('../files/html/product, only size.html') as file:
+    with open(f'{FIXTURES_DIR}/product, only size.html') as file:
         id, silhouette, version, uid_hash = find_product_params(file.read())
         assert id == 'PO252E00N-B110ONE000'
         assert  silhouette == 'headgear'
@@ -11,21 +12,76 @@ def test_find_product_params():
         assert uid_hash == '4b9f18396dbdd59e2aa893a8c347b012'
 
 
+def test_find_product_params_full_dom():
+    with open(f'{FIXTURES_DIR}/product, only size.html') as file:
+        text = file.read()
+        assert find_product_params(text, streaming=False) == find_product_params(text)
+
+
+def test_find_product_params_bytes():
+    with open(f'{FIXTURES_DIR}/product, only size.html', 'rb') as file:
+        body = file.read()
+        assert find_product_params(body, 'utf-8') == find_product_params(body.decode())
+        assert find_product_params(body, 'utf-8', streaming=False) == find_product_params(body.decode())
+
+
+def test_find_product_units():
+    with open(f'{FIXTURES_DIR}/product, only size.html') as file:
+        units = find_product_units(file.read())
+        size, available = units['PO252E00N-B110ONE000']
+        assert available
+
+
 def test_find_address_id():
-    with open('../files/html/checkout/address.html') as file:
+    with open(f'{FIXTURES_DIR}/checkout/address.html') as file:
         id = find_address_id(file.read())
         assert id == '17530966'
 
 
 def test_find_rand_product_url():
-    with open('../files/html/accessories.html') as file:
+    with open(f'{FIXTURES_DIR}/accessories.html') as file:
         url: str = find_rand_product_url(file.read())
         assert url.startswith('/')
         assert url.endswith('.html')
 
 
 def test_find_redeem_params():
-    with open('../files/html/cart.html') as file:
+    with open(f'{FIXTURES_DIR}/cart.html') as file:
         cart_id, flow_id = find_redeem_params(file.read())
         assert cart_id == '6870e7421eae62ea11d603282d71904a224a9cb9bc884ed40b28eaa5b60c8fc4'
         assert flow_id == 'TuOM0bMmS78Il9y8'
+
+
+def test_parsed_page():
+    with open(f'{FIXTURES_DIR}/accessories.html') as file:
+        page = ParsedPage(file.read())
+        html = page.html
+        assert page.product_urls
+        assert all(url.endswith('.html') for url in page.product_urls)
+        assert page.product_urls is page.product_urls
+        assert page.html is html
+
+
+def test_parse_cache():
+    cache = ParseCache(entries=2)
+    calls = []
+
+    def extract(text):
+        calls.append(text)
+        return text.upper()
+
+    assert cache.get('upper', 'a', extract) == 'A'
+    assert cache.get('upper', 'a', extract) == 'A'
+    assert cache.get('upper', 'b', extract) == 'B'
+    assert cache.get('upper', 'c', extract) == 'C'
+    assert cache.get('upper', 'a', extract) == 'A'
+    assert calls == ['a', 'b', 'c', 'a']
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 4, 2)
+
+    cache = ParseCache(max_bytes=600)
+    cache.get('upper', 'a' * 100, extract)
+    assert 100 < cache.bytes < 600
+    cache.get('upper', 'b' * 100, extract)
+    cache.get('upper', 'c' * 100, extract)
+    assert cache.evictions >= 1
+    assert cache.bytes <= 600
@@ -0,0 +1,54 @@
+import time
+import pstats
+import asyncio
+
+from executors import ParseExecutor
+from profiling import Profiler
+from steps import Step, StepGraph
+
+
+def spin():
+    started = time.perf_counter()
+    while time.perf_counter() - started < 0.1:
+        pass
+
+
+async def busy(owner, data):
+    await asyncio.sleep(0)
+    spin()
+
+
+async def parse(owner, data):
+    await owner.run(spin)
+
+
+def run_profiled(profiler, executor=None):
+    graph = StepGraph([Step('busy', busy), Step('parse', parse)])
+
+    async def run():
+        profiler.start()
+        await asyncio.create_task(graph.run(executor or ParseExecutor(), {}), name='ctx')
+        profiler.stop()
+
+    asyncio.run(run())
+
+
+def test_sampling_profiler(tmp_path):
+    profiler = Profiler(str(tmp_path / 'profile'), Profiler.SAMPLING, interval=0.001)
+    executor = ParseExecutor(ParseExecutor.THREAD)
+    run_profiled(profiler, executor)
+    executor.shutdown()
+    stacks = (tmp_path / 'profile.collapsed').read_text().splitlines()
+    assert any(line.startswith('busy;') and 'test_profiling.py:busy;test_profiling.py:spin ' in line
+               for line in stacks)
+    # the parse thread, by the step it parses for
+    assert any(line.startswith('parse;') and 'executors.py:_thread_call' in line and 'test_profiling.py:spin ' in line
+               for line in stacks)
+    stats = pstats.Stats(str(tmp_path / 'profile.pstats'))
+    assert any(name == 'busy' for _, _, name in stats.stats)
+
+
+def test_deterministic_profiler(tmp_path):
+    run_profiled(Profiler(str(tmp_path / 'profile')))
+    stats = pstats.Stats(str(tmp_path / 'profile.pstats'))
+    assert any(name == 'busy' for _, _, name in stats.stats)
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientResponseError
+
+from retries import CircuitOpenError, Retries, RetryPolicy
+
+
+def failing(times, status=503):
+    calls = []
+
+    async def request():
+        calls.append(status)
+        if len(calls) <= times:
+            raise ClientResponseError(None, (), status=status)
+        return 'ok'
+    return request, calls
+
+
+def test_retries():
+    retries = Retries(budget=3)
+    policy = RetryPolicy(attempts=3, backoff=0.001)
+
+    request, calls = failing(2)
+    assert asyncio.run(retries.task().call('api_cart_count', policy, request)) == 'ok'
+    assert len(calls) == 3
+
+    # the budget of a task is shared by its requests
+    task = retries.task()
+    asyncio.run(task.call('api_cart_count', policy, failing(2)[0]))
+    with pytest.raises(ClientResponseError):
+        asyncio.run(task.call('api_cart_details', policy, failing(2)[0]))
+
+    request, calls = failing(1, status=404)
+    with pytest.raises(ClientResponseError):
+        asyncio.run(retries.task().call('product_page', policy, request))
+    assert len(calls) == 1
+
+    request, calls = failing(1)
+    with pytest.raises(ClientResponseError):
+        asyncio.run(retries.task().call('api_redeem', RetryPolicy(idempotent=False), request))
+    assert len(calls) == 1
+
+    assert retries.retries['api_cart_count'] == 4
+    assert retries.recovered['api_cart_count'] == 2
+    assert retries.exhausted['api_cart_details'] == 1
+
+
+def test_circuit_breaker():
+    retries = Retries(threshold=2, reset_timeout=0.05)
+    policy = RetryPolicy(attempts=1)
+
+    for _ in range(2):
+        with pytest.raises(ClientResponseError):
+            asyncio.run(retries.task().call('api_next_step', policy, failing(1)[0]))
+    request, calls = failing(0)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(retries.task().call('api_next_step', policy, request))
+    assert not calls
+
+    asyncio.run(asyncio.sleep(0.05))
+    assert asyncio.run(retries.task().call('api_next_step', policy, request)) == 'ok'
+    assert retries.breaker('api_next_step').opened is None
+    assert retries.rejected['api_next_step'] == 1
@@ -28,11 +28,11 @@ def test_purchasing_task(session_mock, find_product_params_mock, find_address_id
     flow_id = 'flow_id'
     address_id = 'address_id'
     cart_count = 1
-    accessories_page_html = 'accessories page html'
-    product_page_html = 'product page html'
-    cart_page_html = 'cart page html'
-    checkout_confirm_page_html = 'checkout confirm page html'
-    api_next_step_json = {'url': 'api/next/url'}
+    accessories_page_html = b'accessories page html'
+    product_page_html = b'product page html'
+    cart_page_html = b'cart page html'
+    checkout_confirm_page_html = b'checkout confirm page html'
+    api_next_step_json = b'{"url": "api/next/url"}'
 
     # mocks
     cookies = {'frsx': Mock(value='frsx value'), 'Zalando-Client-Id': Mock(value='zclient id')}
@@ -41,34 +41,39 @@ def test_purchasing_task(session_mock, find_product_params_mock, find_address_id
     find_product_params_mock.return_value = product_id, silhouette, version, uid_hash
     find_redeem_params_mock.return_value = cart_id, flow_id
     find_address_id_mock.return_value = address_id
-    get_responses = [Mock(headers={'x-zalando-child-request-id': 'rid'}),
-                     Mock(),
-                     Mock(),
-                     Mock(text=AsyncMock(return_value=accessories_page_html)),
-                     Mock(text=AsyncMock(return_value=product_page_html)),
-                     Mock(),
-                     Mock(),
-                     Mock(json=AsyncMock(return_value=cart_count)),
-                     Mock(),
-                     Mock(text=AsyncMock(return_value=cart_page_html)),
-                     Mock(text=AsyncMock(return_value=checkout_confirm_page_html)),
-                     Mock(json=AsyncMock(return_value=api_next_step_json)),
-                     Mock(status=307, headers={'location': 'location/1'}),
-                     Mock(status=303, headers={'location': 'location/2'}),
-                     Mock(),
-                     Mock(text=AsyncMock(return_value=cart_page_html)),
+    # the bodies which are not read are drained
+    empty = Mock(readany=AsyncMock(return_value=b''))
+    get_responses = [Mock(headers={'x-zalando-child-request-id': 'rid'}, content=empty),
+                     Mock(content=empty),
+                     Mock(content=empty),
+                     Mock(read=AsyncMock(return_value=accessories_page_html), charset='utf-8'),
+                     Mock(read=AsyncMock(return_value=product_page_html), charset='utf-8'),
+                     Mock(content=empty),
+                     Mock(content=empty),
+                     Mock(read=AsyncMock(return_value=str(cart_count).encode())),
+                     Mock(content=empty),
+                     Mock(read=AsyncMock(return_value=cart_page_html), charset='utf-8'),
+                     Mock(read=AsyncMock(return_value=checkout_confirm_page_html), charset='utf-8'),
+                     Mock(read=AsyncMock(return_value=api_next_step_json)),
+                     Mock(status=307, headers={'location': 'location/1'}, content=empty),
+                     Mock(status=303, headers={'location': 'location/2'}, content=empty),
+                     Mock(content=empty),
+                     Mock(read=AsyncMock(return_value=cart_page_html), charset='utf-8'),
                      ]
     session_mock.return_value = AsyncMock(cookie_jar=cookie_jar,
                                           get=AsyncMock(side_effect=get_responses),
-                                          post=AsyncMock(),
-                                          request=AsyncMock())
+                                          post=AsyncMock(return_value=Mock(content=empty)),
+                                          request=AsyncMock(return_value=Mock(content=empty)))
     pt = PurchasingTask(api_data)
     token = ptask_id.set(pt.get_id())
     asyncio.run(pt.run())
     ptask_id.reset(token)
 
-    find_rand_product_url_mock.assert_called_once_with(accessories_page_html)
-    find_product_params_mock.assert_called_once_with(product_page_html)
-    find_redeem_params_mock.assert_called_once_with(cart_page_html)
-    find_address_id_mock.assert_called_once_with(checkout_confirm_page_html)
+    find_rand_product_url_mock.assert_called_once_with(accessories_page_html, 'utf-8')
+    find_product_params_mock.assert_called_once_with(product_page_html, 'utf-8')
+    find_redeem_params_mock.assert_called_once_with(cart_page_html, 'utf-8')
+    find_address_id_mock.assert_called_once_with(checkout_confirm_page_html, 'utf-8')
+    assert pt.api.bodies.read == 2 * len(cart_page_html) + len(accessories_page_html) + len(product_page_html) + \
+        len(checkout_confirm_page_html) + 1 + len(api_next_step_json)
+    assert pt.api.bodies.decoded == 1 + len(api_next_step_json)
     assert pt.session.closed
@@ -0,0 +1,63 @@
+import time
+import asyncio
+
+from scheduler import TaskScheduler, TokenBucket
+from utils import Clock, WarpClock, set_clock, sleep_for
+
+
+def test_task_scheduler():
+    running = []
+    peak = []
+
+    async def run_flow(row):
+        running.append(row)
+        peak.append(len(running))
+        await asyncio.sleep(0.5 if row['login'] == 'slow' else 0.01)
+        running.remove(row)
+        if row['login'] == 'broken':
+            raise ValueError(row['login'])
+        if row['login'] == 'request timeout':
+            raise asyncio.TimeoutError()
+
+    rows = [{'login': 'ok'} for _ in range(20)] + [{'login': 'broken'}, {'login': 'request timeout'},
+                                                   {'login': 'slow'}]
+    scheduler = TaskScheduler(run_flow, concurrency=4, deadline=0.2)
+    asyncio.run(scheduler.run(iter(rows)))
+
+    assert max(peak) == 4
+    assert scheduler.succeeded == 20
+    assert scheduler.failed == 2
+    assert scheduler.timed_out == 1
+
+
+def test_task_scheduler_warped():
+    async def run_flow(row):
+        await sleep_for(row['sleep'])
+        await asyncio.sleep(0.05)
+
+    rows = [{'login': f'login{i}', 'sleep': 30} for i in range(4)] + [{'login': 'slow', 'sleep': 300}]
+    scheduler = TaskScheduler(run_flow, concurrency=5, deadline=100)
+    set_clock(WarpClock(1000))
+    try:
+        asyncio.run(scheduler.run(iter(rows)))
+    finally:
+        set_clock(Clock())
+
+    # the flows run at once for their sleeps and the real time of the rest, the slow one until the deadline
+    assert scheduler.succeeded == 4
+    assert scheduler.timed_out == 1
+    assert 100 <= scheduler.elapsed < 101
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=50, burst=5)
+
+    async def run():
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(15)))
+        return time.monotonic() - started
+
+    # the burst is free, the rest comes at the rate
+    assert 0.18 <= asyncio.run(run()) < 0.4
+    assert bucket.acquired == 15
+    assert bucket.waited == 10
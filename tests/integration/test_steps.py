@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from run import PurchasingTask
+from steps import Step, StepGraph
+
+
+def sleeping(seconds, **outputs):
+    async def func(owner, data):
+        owner.append(func)
+        await asyncio.sleep(seconds)
+        return outputs
+    return func
+
+
+def test_step_graph():
+    graph = StepGraph([
+        Step('page', sleeping(0.05, product='p'), provides=('product',)),
+        Step('wishlist', sleeping(0.1), requires=('product',)),
+        Step('brands', sleeping(0.1), requires=('product',)),
+        Step('cart', sleeping(0.02, cart='c'), requires=('product',), provides=('cart',)),
+        Step('redeem', sleeping(0.05), requires=('cart',)),
+    ])
+
+    data = {}
+    timings = asyncio.run(graph.run([], data))
+    assert data == {'product': 'p', 'cart': 'c'}
+    assert timings.wall >= 0.3
+
+    timings = asyncio.run(graph.run([], {}, overlap=True))
+    assert timings.wall < 0.2
+    assert timings.critical_path in (['page', 'wishlist'], ['page', 'brands'])
+
+
+def test_step_graph_requirements():
+    with pytest.raises(ValueError):
+        StepGraph([Step('redeem', sleeping(0), requires=('cart',))])
+
+
+def test_decrease_steps_order():
+    spans = {}
+
+    def recording(step):
+        async def func(owner, data):
+            started = len(owner)
+            owner.append(step.name)
+            await asyncio.sleep(0.01)
+            spans[step.name] = started, len(owner)
+            owner.append(step.name)
+            return {key: True for key in step.provides}
+        return func
+
+    graph = StepGraph([Step(s.name, recording(s), s.requires, s.provides) for s in PurchasingTask.DECREASE_STEPS.steps],
+                      initial=('xsrf',))
+    asyncio.run(graph.run([], {'xsrf': 'xsrf'}, overlap=True))
+
+    def before(first, second):
+        return spans[first][1] <= spans[second][0]
+
+    assert not before('sizereco', 'check_wishlist') and not before('check_wishlist', 'sizereco')
+    assert before('preference_brands', 'cart')
+    assert before('cart_count', 'cart_details') and before('cart_details', 'cart_page')
+    assert before('confirm_resources', 'remove_item')
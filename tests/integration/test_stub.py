@@ -0,0 +1,298 @@
+import os
+import re
+import csv
+import json
+import time
+import asyncio
+from unittest.mock import patch
+
+import pytest
+from aiohttp import CookieJar
+
+from api import ZalandoAPI
+from checkpoints import StepCheckpoints
+from monitor import ProductMonitor, ProductWatch
+from pool import ConnectionPool
+from results import ResultSink, TaskOutcome
+from run import PurchasingTask, ptask_id
+from snapshots import SessionSnapshots
+from stub import ZalandoStub
+from utils import Clock, Delay, WarpClock, now, set_clock
+
+
+class StubServer:
+    # the stub the api is pointed at while the server is entered, within a running loop
+
+    def __init__(self):
+        self.stub = ZalandoStub()
+        self.api_data = {'login': 'login',
+                         'password': 'password',
+                         'id': 'od',
+                         'dcode': 'dcode',
+                         'size': 'size'}
+        self._index_url = ZalandoAPI.INDEX_URL
+
+    def account(self, **fields):
+        return {**self.api_data, **fields}
+
+    async def __aenter__(self):
+        ZalandoAPI.set_index_url(await self.stub.start())
+        return self.stub
+
+    async def __aexit__(self, *exc_info):
+        ZalandoAPI.set_index_url(self._index_url)
+        await self.stub.close()
+
+
+@pytest.fixture
+def server():
+    return StubServer()
+
+
+@patch.dict('run.Delay.DEFAULTS', {k: (0, 0) for k in Delay.DEFAULTS})
+def test_purchasing_task_against_stub(server):
+    async def run():
+        async with server:
+            pt = PurchasingTask(server.api_data)
+            token = ptask_id.set(pt.get_id())
+            await pt.run()
+            ptask_id.reset(token)
+            return pt
+
+    pt = asyncio.run(run())
+
+    assert pt.session.closed
+    assert server.stub.requests['/payment/complete'] == 1
+    assert server.stub.requests['/api/checkout/remove-confirmation-item'] == 1
+    assert server.stub.errors == 0
+
+
+@patch.dict('run.Delay.DEFAULTS', {k: (0, 0) for k in Delay.DEFAULTS})
+def test_connection_pool(server):
+    pool = ConnectionPool()
+
+    async def run():
+        async with server:
+            try:
+                for i in range(2):
+                    pt = PurchasingTask(server.account(login=f'login{i}'), pool=pool)
+                    await pt.run()
+            finally:
+                await pool.close()
+        return pt
+
+    pt = asyncio.run(run())
+
+    # the bodies which are not read are drained, so the flows run on the connections of the first request
+    assert pool.opened == 1
+    assert pool.reused == sum(server.stub.requests.values()) - 1
+    assert pt.api.bodies.drained > 0
+
+
+@patch.dict('run.Delay.DEFAULTS', {k: (0, 0) for k in Delay.DEFAULTS})
+def test_session_snapshots(server, tmp_path):
+    snapshots = SessionSnapshots(str(tmp_path))
+
+    async def run():
+        async with server:
+            for _ in range(2):
+                await PurchasingTask(server.api_data, snapshots=snapshots).run()
+
+    asyncio.run(run())
+
+    assert server.stub.requests['/login'] == 1
+    assert server.stub.requests['/api/reef/login'] == 1
+    assert server.stub.requests['/payment/complete'] == 2
+    assert snapshots.misses == 1
+    assert snapshots.hits == 1
+    paths = snapshots._paths('login')
+    assert all(os.stat(path).st_mode & 0o777 == 0o600 for path in paths)
+
+    async def load():
+        cookie_jar = CookieJar()
+        return snapshots.load('login', cookie_jar), {morsel.key: morsel.value for morsel in cookie_jar}
+
+    snapshot, cookies = asyncio.run(load())
+    assert snapshot['xsrf'] == cookies['frsx'] == 'stub-xsrf-token'
+
+    with open(paths[1], 'w') as file:
+        file.write('[{"name": ')
+    assert asyncio.run(load()) == (None, {})
+    assert snapshots.misses == 2
+
+
+@patch.dict('run.Delay.DEFAULTS', {k: (0, 0) for k in Delay.DEFAULTS})
+def test_step_checkpoints(server, tmp_path):
+    checkpoints = StepCheckpoints(str(tmp_path))
+    payment_selection = ZalandoAPI.payment_selection
+
+    async def failing_payment_selection(self, url):
+        raise ValueError('Invalid redirection status 500')
+
+    async def run():
+        async with server:
+            with patch.object(ZalandoAPI, 'payment_selection', failing_payment_selection):
+                with pytest.raises(ValueError):
+                    await PurchasingTask(server.api_data, checkpoints=checkpoints).run()
+            with patch.object(ZalandoAPI, 'payment_selection', payment_selection):
+                await PurchasingTask(server.api_data, checkpoints=checkpoints).run()
+
+    asyncio.run(run())
+
+    assert server.stub.requests['/cart'] == 2
+    assert server.stub.requests['/payment/session'] == 1
+    assert server.stub.requests['/payment/complete'] == 1
+    assert checkpoints.resumed == 1
+    assert checkpoints.requests_saved > 20
+    assert checkpoints.load('login') is None
+
+
+@patch.dict('run.Delay.DEFAULTS', {k: (0, 0) for k in Delay.DEFAULTS})
+def test_product_monitor(server):
+    stub = server.stub
+    available = stub.pages['product']
+    stub.set_product('/watched.html', re.sub(rb'"available":\s*true', b'"available": false', available))
+    monitor = ProductMonitor(0.05)
+
+    async def run():
+        async with server:
+            try:
+                accounts = [server.account(login=f'login{i}', product_url='watched.html', size='') for i in range(5)]
+                tasks = [asyncio.ensure_future(PurchasingTask(account, monitor=monitor).run()) for account in accounts]
+                while monitor.polls < 5:
+                    await asyncio.sleep(0.05)
+                assert not any(task.done() for task in tasks)
+                stub.set_product('/watched.html', available)
+                await asyncio.wait_for(asyncio.gather(*tasks), 1)
+            finally:
+                await monitor.close()
+
+    asyncio.run(run())
+
+    # the product pages of the flows and the polls of a single watch
+    assert stub.requests['/{product}'] == 5 + monitor.polls
+    assert monitor.not_modified == monitor.polls - 2
+    assert monitor.changes == 1
+    assert len(monitor.delays) == 1
+    assert monitor.notifications == 10
+    assert not monitor.watches
+
+
+def test_product_monitor_errors(server):
+    stub = server.stub
+    stub.set_product('/broken.html', b'')
+    stub.set_product('/unavailable.html', re.sub(rb'"available":\s*true', b'"available": false', stub.pages['product']))
+    monitor = ProductMonitor(0.01, max_errors=2, wait_timeout=0.2)
+
+    async def run():
+        async with server:
+            try:
+                with pytest.raises(TypeError):
+                    await monitor.wait_available('broken.html')
+                with pytest.raises(asyncio.TimeoutError):
+                    await monitor.wait_available('unavailable.html')
+            finally:
+                await monitor.close()
+
+    asyncio.run(run())
+    assert monitor.errors >= 2
+    assert not monitor.watches
+
+
+def test_product_monitor_intervals():
+    monitor = ProductMonitor(1, min_interval=0.5, max_interval=4)
+    watch = ProductWatch('product.html', 1)
+    for now in (1, 2, 3):
+        monitor._adapt(watch, False, now)
+    assert watch.interval == 3.375
+    monitor._adapt(watch, False, 4)
+    assert watch.interval == 4
+
+    monitor._adapt(watch, True, 10)
+    assert watch.interval == 1
+    monitor._adapt(watch, True, 14)
+    assert watch.interval == 1
+    monitor._adapt(watch, True, 15)
+    assert watch.interval == 0.625
+
+
+def test_purchasing_task_warped(server):
+    delays = []
+    make = Delay.make
+
+    def recorded(category):
+        delays.append(make(category))
+        return delays[-1]
+
+    async def run():
+        async with server:
+            set_clock(WarpClock(1000))
+            try:
+                with patch.object(Delay, 'make', recorded):
+                    started = now()
+                    await PurchasingTask(server.api_data).run()
+                    return now() - started
+            finally:
+                set_clock(Clock())
+
+    started = time.monotonic()
+    duration = asyncio.run(run())
+    real = time.monotonic() - started
+
+    # the delays of the flow are not patched, they take tens of simulated seconds and the requests their real time
+    assert real < 5
+    assert sum(delays) > 20
+    assert sum(delays) <= duration < sum(delays) + real
+    assert server.stub.requests['/payment/complete'] == 1
+
+
+@patch.dict('run.Delay.DEFAULTS', {k: (0, 0) for k in Delay.DEFAULTS})
+def test_result_sink(server, tmp_path):
+    sinks = [ResultSink(str(tmp_path / 'results.jsonl'), batch_size=2), ResultSink(str(tmp_path / 'results.csv'))]
+
+    async def failing_payment_selection(self, url):
+        raise ValueError('Invalid redirection status 500')
+
+    async def run():
+        async with server:
+            for results in sinks:
+                try:
+                    tasks = [PurchasingTask(server.account(login=f'login{i}'), results=results).run()
+                             for i in range(3)]
+                    with patch.object(ZalandoAPI, 'payment_selection', failing_payment_selection):
+                        with pytest.raises(ValueError):
+                            await tasks[0]
+                    await asyncio.gather(*tasks[1:])
+                finally:
+                    await results.close()
+
+    asyncio.run(run())
+
+    with open(tmp_path / 'results.jsonl') as file:
+        outcomes = [json.loads(line) for line in file]
+    assert sinks[0].batches == 2
+    assert [o['status'] for o in outcomes] == ['failed', 'succeeded', 'succeeded']
+    assert outcomes[0]['final_step'] == 'payment_selection'
+    assert outcomes[0]['error'] == 'ValueError'
+    assert outcomes[1]['final_step'] == 'log_out'
+    assert outcomes[1]['requests'] > outcomes[0]['requests'] > 0
+    assert 'payment_selection' not in outcomes[0]['steps']
+    assert 'payment_session' in outcomes[0]['steps']
+
+    with open(tmp_path / 'results.csv') as file:
+        rows = list(csv.DictReader(file))
+    assert [row['status'] for row in rows] == ['failed', 'succeeded', 'succeeded']
+    assert json.loads(rows[1]['steps']).keys() == outcomes[1]['steps'].keys()
+
+
+def test_result_sink_write_errors(tmp_path):
+    results = ResultSink(str(tmp_path / 'missing' / 'results.jsonl'), batch_size=1)
+
+    async def run():
+        for i in range(3):
+            results.emit(TaskOutcome(f'ctx{i}', f'login{i}', 'succeeded', 'log_out'))
+        await results.close()
+
+    asyncio.run(run())
+    assert results.lost == 3
+    assert results.records == 0
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+
+import pytest
+from aiohttp import ClientResponseError, ClientSession, web
+
+from tracing import FlightRecorder
+
+
+async def unavailable(request):
+    return web.Response(status=503, body=b'try later')
+
+
+def test_flight_recorder(caplog):
+    recorder = FlightRecorder(2)
+
+    async def run():
+        app = web.Application()
+        app.add_routes([web.get('/unavailable', unavailable)])
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, 'localhost', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            async with ClientSession(raise_for_status=True, trace_configs=[recorder.trace_config]) as session:
+                for _ in range(3):
+                    with pytest.raises(ClientResponseError):
+                        await session.get(f'http://localhost:{port}/unavailable')
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+    assert len(recorder.records) == 2
+    assert recorder.records[0].status == 503
+    caplog.clear()
+    with caplog.at_level(logging.ERROR):
+        recorder.dump()
+    assert len(caplog.records) == 2
+    assert '503 Service Unavailable ClientResponseError' in caplog.records[0].getMessage()